@@ -4,14 +4,255 @@
 
 Functions to make API calls.
 
+All requests go through one pooled keep-alive session per host, so pages and
+entity lookups reuse open TLS connections instead of handshaking every time.
+They are sent via a shared RequestScheduler (scheduler.py), which limits the
+request rate and concurrency and retries throttled and failed requests.
+Query responses can optionally be kept in a disk-backed ResponseCache
+(response_cache.py).
+
 @author: amagrabi
 
 """
 
+import json
+import os
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from scheduler import RequestScheduler
+
+
+# Auth and API base urls per host
+HOSTS = {'EU': ('https://auth.sphere.io', 'https://api.sphere.io'),
+         'US': ('https://auth.commercetools.co', 'https://api.commercetools.co')}
+
+# Transport settings (change via configure())
+POOL_SIZE = 10
+TIMEOUT = (10, 60)    # (connect, read) in seconds
+
+# Token cache settings (change via configure())
+TOKEN_MARGIN = 60     # refresh tokens this many seconds before they expire
+TOKEN_FILE = None     # optional path to persist tokens between runs
+
+# Request scheduling (change via configure())
+RATE = None           # maximum requests per second (None for no limit)
+MAX_RETRIES = 6       # retries of throttled and failed requests
+
+# Optional ResponseCache of query responses (change via configure())
+CACHE = None
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+# Request statistics (see get_stats())
+_stats = {'requests': 0, 'logins': 0, 'bytes': 0, 'cache_hits': 0,
+          'revalidated': 0, 'time_fetch': 0.0, 'time_parse': 0.0}
+_stats_lock = threading.Lock()
+
+
+class APIError(Exception):
+    '''Error response of the API (after all retries).
+
+    Attributes:
+        status_code: HTTP status of the response.
+        body: Decoded json body of the response (None if it is no json).
+
+    '''
+
+    def __init__(self, message, status_code=None, body=None):
+        super(APIError, self).__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+class NotFound(APIError):
+    '''The requested resource does not exist (404).
+
+    '''
+
+
+def _new_scheduler(share=1):
+    # The concurrency limit starts at half the pool and never exceeds it, so
+    # concurrent requests always find a pooled connection. Processes which
+    # send requests in parallel get 1/share of the limits each.
+    rate = RATE/share if RATE else None
+    return RequestScheduler(rate=rate, concurrency=max(1, POOL_SIZE//2//share),
+                            max_concurrency=max(1, POOL_SIZE//share),
+                            max_retries=MAX_RETRIES)
+
+
+_scheduler = _new_scheduler()
+
+
+def configure(pool_size=None, timeout=None, token_margin=None, token_file=None,
+              rate=None, max_retries=None, cache=None):
+    '''Change transport and token cache settings for all subsequent requests.
+
+    Args:
+        pool_size: Maximum number of pooled connections per host.
+        timeout: Default request timeout in seconds, either a number or a
+            (connect, read) tuple.
+        token_margin: Seconds before expiry at which cached tokens are renewed.
+        token_file: Path of a file to persist tokens in (empty string disables).
+        rate: Maximum requests per second (0 disables the limit).
+        max_retries: Retries of throttled and failed requests.
+        cache: ResponseCache for query responses (False disables it).
+
+    '''
+    global POOL_SIZE, TIMEOUT, TOKEN_MARGIN, TOKEN_FILE, RATE, MAX_RETRIES, CACHE, _scheduler
+    if cache is not None:
+        CACHE = None if cache is False else cache
+    if token_margin is not None:
+        TOKEN_MARGIN = token_margin
+    if token_file is not None:
+        TOKEN_FILE = token_file or None
+    with _sessions_lock:
+        if pool_size is not None:
+            POOL_SIZE = pool_size
+            # Existing sessions keep their old pools, so drop them
+            for session in _sessions.values():
+                session.close()
+            _sessions.clear()
+        if timeout is not None:
+            TIMEOUT = timeout
+    if rate is not None:
+        RATE = rate or None
+    if max_retries is not None:
+        MAX_RETRIES = max_retries
+    if pool_size is not None or rate is not None or max_retries is not None:
+        _scheduler = _new_scheduler()
+
+
+def share_limits(processes):
+    '''Limits the requests of this process to its share of the configured 
+    rate and concurrency, for worker processes which send requests in 
+    parallel (call in each of the processes).
+
+    Args:
+        processes: Number of processes sending requests in parallel.
+
+    '''
+    global _scheduler
+    _scheduler = _new_scheduler(max(1, processes))
+
+
+def register_host(host, auth_url, api_url):
+    '''Register an additional host (e.g. a local test server).
+
+    Args:
+        host: Name of the host as passed to login() and query().
+        auth_url: Base url of the auth service.
+        api_url: Base url of the API.
+
+    '''
+    HOSTS[host] = (auth_url.rstrip('/'), api_url.rstrip('/'))
+
+
+def get_session(base_url):
+    '''Get the pooled keep-alive session for a base url (one per host).
+
+    Args:
+        base_url: Base url of the auth service or API.
+
+    Returns:
+        requests.Session.
+
+    '''
+    session = _sessions.get(base_url)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(base_url)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _sessions[base_url] = session
+    return session
 
 
-def login(client_id, client_secret, project_key, scope, host = 'EU'):
+def close_sessions():
+    '''Close all pooled sessions.
+
+    '''
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def reset_stats():
+    '''Resets the request statistics.
+
+    '''
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0.0 if key.startswith('time') else 0
+        for key in _scheduler.stats:
+            _scheduler.stats[key] = 0
+
+
+def get_stats():
+    '''Request statistics since the last reset_stats().
+
+    Returns:
+        Dictionary with the number of API requests and logins, the bytes of
+        all response bodies, the number of responses served from the cache
+        (cache_hits, including revalidated ones), the cumulated seconds
+        spent waiting for responses (time_fetch, including retries) and
+        decoding json (time_parse), and the number of retries and throttled
+        responses.
+
+    '''
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update(_scheduler.stats)
+    return stats
+
+
+def add_stats(stats):
+    '''Adds request statistics of another process (from its get_stats()).
+
+    '''
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] += stats.get(key, 0)
+        for key in _scheduler.stats:
+            _scheduler.stats[key] += stats.get(key, 0)
+
+
+def _count(key, value=1):
+    with _stats_lock:
+        _stats[key] += value
+
+
+def _host_urls(host):
+    try:
+        return HOSTS[host]
+    except KeyError:
+        raise Exception("Host is unknown (has to be one of {}).".format(sorted(HOSTS)))
+
+
+def _error(r, url):
+    try:
+        body = r.json()
+    except ValueError:
+        body = None
+    message = "Request failed with status {}: {}".format(r.status_code, url)
+    if isinstance(body, dict) and body.get('message'):
+        message += " ({})".format(body['message'])
+    error = NotFound if r.status_code == 404 else APIError
+    return error(message, r.status_code, body)
+
+
+def login(client_id, client_secret, project_key, scope, host = 'EU', timeout = None):
     '''Authentification
     
     Args:
@@ -19,7 +260,8 @@ def login(client_id, client_secret, project_key, scope, host = 'EU'):
         client_secret: client_secret.
         project_key: project_key.
         scope: Scope of access (read, write, etc.).
-        host: 'EU' or 'NA'.
+        host: 'EU' or 'US' (or a host added via register_host()).
+        timeout: Request timeout (default: TIMEOUT).
         
     Returns:
         Authentification data.
@@ -27,40 +269,161 @@ def login(client_id, client_secret, project_key, scope, host = 'EU'):
     '''
     headers = { 'Content-Type' : 'application/x-www-form-urlencoded' }
     body = "grant_type=client_credentials&scope=%s" % scope
-    if host == 'EU':
-        url = "https://auth.sphere.io/oauth/token"
-    elif host == 'US':
-        url = "https://auth.commercetools.co/oauth/token"
-    else:
-        raise Exception("Host is unknown (has to be 'EU' or 'US').")
+    auth_url = _host_urls(host)[0]
+    url = "%s/oauth/token" % auth_url
     auth = (client_id, client_secret)
-    r = requests.post(url, data=body, headers=headers, auth=auth)
-    if r.status_code is 200:
+    session = get_session(auth_url)
+    timeout = TIMEOUT if timeout is None else timeout
+    r = _scheduler.send(lambda: session.post(url, data=body, headers=headers,
+                                             auth=auth, timeout=timeout))
+    _count('logins')
+    if r.status_code == 200:
         return r.json()
     else:
-        raise Exception("Failed to get an access token. Are you sure you have added them to config.py?")
+        raise APIError("Failed to get an access token. Are you sure you have added them to config.py?",
+                       r.status_code)
 
         
-def query(endpoint, project_key, auth, host = 'EU'):
+def query(endpoint, project_key, auth, host = 'EU', timeout = None):
     '''Fetch Data via API into Json-Format
     
     Args:
         endpoint: API endpoint (products, orders, etc.).
         project_key: project_key.
         auth: Login data.
-        host: 'EU' or 'NA'.
+        host: 'EU' or 'US' (or a host added via register_host()).
+        timeout: Request timeout (default: TIMEOUT).
         
     Returns:
         Query output in json.
         
+    Raises:
+        NotFound: The resource does not exist.
+        APIError: Any other error response (after all retries), or a 
+            response which is not cached in offline mode.
+        
     '''
     headers = { "Authorization" : "Bearer %s" % auth["access_token"] }
-    if host == 'EU':
-        url = "https://api.sphere.io/%s/%s" % (project_key, endpoint)
-    elif host == 'US':
-        url = "https://api.commercetools.co/%s/%s" % (project_key, endpoint)
-    else:
-        raise Exception("Host is unknown (has to be 'EU' or 'US').")
-    r = requests.get(url, headers=headers)
+    api_url = _host_urls(host)[1]
+    url = "%s/%s/%s" % (api_url, project_key, endpoint)
+    cache = CACHE
+    entry = cache.get(url) if cache is not None else None
+    if entry is not None and (entry['fresh'] or cache.offline):
+        _count('cache_hits')
+        return _parse(entry['body'])
+    if cache is not None and cache.offline:
+        raise APIError("Response is not cached (offline mode): %s" % url)
+    if entry is not None and entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+    session = get_session(api_url)
+    timeout = TIMEOUT if timeout is None else timeout
+    start = time.time()
+    r = _scheduler.send(lambda: session.get(url, headers=headers, timeout=timeout))
+    fetched = time.time()
+    if r.status_code == 304 and entry is not None:
+        cache.renew(url)
+        with _stats_lock:
+            _stats['requests'] += 1
+            _stats['cache_hits'] += 1
+            _stats['revalidated'] += 1
+            _stats['time_fetch'] += fetched - start
+        return _parse(entry['body'])
+    if r.status_code == 401:
+        # The token was revoked or has expired early, cached_login() renews it
+        invalidate_tokens()
+    if r.status_code >= 400:
+        _count('requests')
+        raise _error(r, url)
     data_json = r.json()    # json-format as nested dict-/list-structure
-    return data_json
\ No newline at end of file
+    parsed = time.time()
+    if cache is not None:
+        version = data_json.get('version') if isinstance(data_json, dict) else None
+        cache.put(url, r.content, r.headers.get('ETag'), version)
+    with _stats_lock:
+        _stats['requests'] += 1
+        _stats['bytes'] += len(r.content)
+        _stats['time_fetch'] += fetched - start
+        _stats['time_parse'] += parsed - fetched
+    return data_json
+
+
+def _parse(body):
+    start = time.time()
+    data_json = json.loads(body.decode('utf-8'))
+    _count('time_parse', time.time() - start)
+    return data_json
+
+
+
+def cached_login(client_id, client_secret, project_key, scope, host = 'EU'):
+    '''Authentification via a process-wide token cache.
+
+    Returns the cached token until TOKEN_MARGIN seconds before it expires, so
+    all modules share one token instead of calling login() per request. Only
+    one thread renews an expired token, the others wait for its result. If
+    TOKEN_FILE is set, tokens are also kept there for subsequent runs. If the
+    response cache is in offline mode, no token is requested.
+
+    Args:
+        client_id: client_id.
+        client_secret: client_secret.
+        project_key: project_key.
+        scope: Scope of access (read, write, etc.).
+        host: 'EU' or 'US' (or a host added via register_host()).
+
+    Returns:
+        Authentification data (same as login()).
+
+    '''
+    if CACHE is not None and CACHE.offline:
+        # No requests in offline mode, query() only serves cached responses
+        return {'access_token': None}
+    key = '|'.join([host, client_id, scope])
+    entry = _tokens.get(key)
+    if entry is not None and time.time() < entry['expires_at'] - TOKEN_MARGIN:
+        return entry['auth']
+    with _tokens_lock:
+        # Another thread may have renewed the token while we were waiting
+        entry = _tokens.get(key)
+        if entry is None and TOKEN_FILE is not None:
+            entry = _read_token_file(TOKEN_FILE).get(key)
+        if entry is None or time.time() >= entry['expires_at'] - TOKEN_MARGIN:
+            requested_at = time.time()
+            auth = login(client_id, client_secret, project_key, scope, host)
+            entry = {'auth': auth,
+                     'expires_at': requested_at + auth.get('expires_in', 0)}
+            if TOKEN_FILE is not None:
+                _write_token_file(TOKEN_FILE, key, entry)
+        _tokens[key] = entry
+    return entry['auth']
+
+
+def invalidate_tokens():
+    '''Drop all cached tokens (e.g. after the API rejected one).
+
+    '''
+    with _tokens_lock:
+        _tokens.clear()
+        if TOKEN_FILE is not None and os.path.exists(TOKEN_FILE):
+            os.remove(TOKEN_FILE)
+
+
+def _read_token_file(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_token_file(path, key, entry):
+    # Drop expired entries and replace the file atomically (tokens are secrets)
+    now = time.time()
+    entries = {k: v for k, v in _read_token_file(path).items()
+               if v.get('expires_at', 0) > now}
+    entries[key] = entry
+    tmp = path + '.tmp'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(entries, f)
+    os.replace(tmp, path)
@@ -10,8 +10,13 @@ Helper functions for API access.
 import config
 import os
 import math
+from urllib.parse import quote
 
-from api import login, query
+from api import cached_login, query, NotFound
+
+
+# Number of ids per request of the batch lookups (keeps urls short)
+BATCH_SIZE = 100
 
 
 def get_prod_name(prod_id, lang='en'):
@@ -25,10 +30,13 @@ def get_prod_name(prod_id, lang='en'):
         Product name (empty string if unavailable).
         
     '''
-    auth = login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
-                 config.SCOPE, config.HOST)
+    auth = cached_login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
+                        config.SCOPE, config.HOST)
     endpoint = os.path.join('products', prod_id)
-    data_json = query(endpoint, config.PROJECT_KEY, auth, config.HOST)
+    try:
+        data_json = query(endpoint, config.PROJECT_KEY, auth, config.HOST)
+    except NotFound:
+        data_json = {}
     name = ''
     try:
         name = data_json['masterData']['current']['name'][lang]
@@ -48,10 +56,13 @@ def get_cat_name(cat_id, lang='en'):
         Category name (empty string if unavailable).
         
     '''
-    auth = login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
-                 config.SCOPE, config.HOST)
+    auth = cached_login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
+                        config.SCOPE, config.HOST)
     endpoint = os.path.join('categories', cat_id)
-    data_json = query(endpoint, config.PROJECT_KEY, auth, config.HOST)
+    try:
+        data_json = query(endpoint, config.PROJECT_KEY, auth, config.HOST)
+    except NotFound:
+        data_json = {}
     name = ''
     try:
         name = data_json['name'][lang]
@@ -70,10 +81,13 @@ def get_categories(prod_id):
         List of categories.
         
     '''
-    auth = login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
-                 config.SCOPE, config.HOST)
+    auth = cached_login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
+                        config.SCOPE, config.HOST)
     endpoint = os.path.join('products', prod_id)
-    data_json = query(endpoint, config.PROJECT_KEY, auth, config.HOST)
+    try:
+        data_json = query(endpoint, config.PROJECT_KEY, auth, config.HOST)
+    except NotFound:
+        data_json = {}
     
     cats = []
     try:
@@ -95,10 +109,13 @@ def get_ancestors(cat_id):
         List of ancestors.
         
     '''
-    auth = login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
-                 config.SCOPE, config.HOST)
+    auth = cached_login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
+                        config.SCOPE, config.HOST)
     endpoint = os.path.join('categories', cat_id)
-    data_json = query(endpoint, config.PROJECT_KEY, auth, config.HOST)
+    try:
+        data_json = query(endpoint, config.PROJECT_KEY, auth, config.HOST)
+    except NotFound:
+        data_json = {}
     
     ancs = []
     try:
@@ -110,29 +127,121 @@ def get_ancestors(cat_id):
     return ancs
     
 
-def get_category_paths(prod_id, output='str', restrict=True):
+def get_entities(resource, ids, batch_size=BATCH_SIZE):
+    '''Get entities by id in chunks of 'where=id in (...)' queries.
+    
+    Args:
+        resource: API endpoint (products, categories, etc.).
+        ids: List of ids.
+        batch_size: Number of ids per request.
+        
+    Returns:
+        Dictionary of entities in json by id (unavailable ids are missing).
+        
+    '''
+    ids = list(dict.fromkeys(ids))
+    entities = {}
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        auth = cached_login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
+                            config.SCOPE, config.HOST)
+        where = 'id in ({})'.format(', '.join('"{}"'.format(i) for i in chunk))
+        endpoint = '{}?limit={}&where={}'.format(resource, len(chunk), quote(where))
+        data_json = query(endpoint, config.PROJECT_KEY, auth, config.HOST)
+        for entity in data_json['results']:
+            entities[entity['id']] = entity
+    return entities
+
+
+def _lookup_batch(resource, ids, get, default, batch_size):
+    entities = get_entities(resource, ids, batch_size)
+    values = {}
+    for entity_id in ids:
+        try:
+            values[entity_id] = get(entities[entity_id])
+        except (KeyError, IndexError, TypeError):
+            values[entity_id] = default()
+    return values
+
+
+def get_prod_name_batch(prod_ids, lang='en', batch_size=BATCH_SIZE):
+    '''Get product names of several products (see get_prod_name).
+    
+    Returns:
+        Dictionary of product names by product id (empty string if unavailable).
+        
+    '''
+    return _lookup_batch('products', prod_ids,
+                         lambda data: data['masterData']['current']['name'][lang],
+                         str, batch_size)
+
+
+def get_cat_name_batch(cat_ids, lang='en', batch_size=BATCH_SIZE):
+    '''Get category names of several categories (see get_cat_name).
+    
+    Returns:
+        Dictionary of category names by category id (empty string if unavailable).
+        
+    '''
+    return _lookup_batch('categories', cat_ids, lambda data: data['name'][lang],
+                         str, batch_size)
+
+
+def get_categories_batch(prod_ids, batch_size=BATCH_SIZE):
+    '''Get the categories of several products (see get_categories).
+    
+    Returns:
+        Dictionary of lists of category ids by product id (empty if unavailable).
+        
+    '''
+    return _lookup_batch('products', prod_ids,
+                         lambda data: [cat['id'] for cat in data['masterData']['current']['categories']],
+                         list, batch_size)
+
+
+def get_ancestors_batch(cat_ids, batch_size=BATCH_SIZE):
+    '''Get the ancestors of several categories (see get_ancestors).
+    
+    Returns:
+        Dictionary of lists of ancestor ids by category id (empty if unavailable).
+        
+    '''
+    return _lookup_batch('categories', cat_ids,
+                         lambda data: [anc['id'] for anc in data['ancestors']],
+                         list, batch_size)
+    
+
+def get_category_paths(prod_id, output='str', restrict=True, index=None,
+                       cats_ids=None, lang='en'):
     '''Get all category paths for a target product via a product id.
     
     Args:
         prod_id: prod_id.
         output: Specifies the output format ('str' or 'dict').
         restrict: If true, only one category path is returned.
+        index: CategoryIndex to resolve category names and ancestors locally 
+            (default: one API call per category and ancestor).
+        cats_ids: Category ids of the product, if already known (saves the 
+            product lookup).
+        lang: Language of category names (default: en).
         
     Returns:
         Category paths (either as 'str' or 'dict').
         
     '''
-    cats_ids = get_categories(prod_id)
-    if cats_ids != []:
-        cats_names = [get_cat_name(cat_id) for cat_id in cats_ids]
-                      
+    if cats_ids is None:
+        cats_ids = get_categories(prod_id)
+    if index is not None:
+        cat_name = lambda cat_id: index.name(cat_id, lang)
+        ancestors = index.ancestors
+    else:
+        cat_name = lambda cat_id: get_cat_name(cat_id, lang)
+        ancestors = get_ancestors
+    if len(cats_ids) > 0:
         # Create dictionary that assigns list of ancestors to a category
-        ancs_ids = {cat_id: [] for cat_id in cats_ids}
-        ancs_names = {cat_name: [] for cat_name in cats_names}
+        ancs_names = {}
         for cat_id in cats_ids:
-            ancs_ids[cat_id] = get_ancestors(cat_id)
-            cat_name = get_cat_name(cat_id)
-            ancs_names[cat_name] = [get_cat_name(anc_id) for anc_id in ancs_ids[cat_id]]
+            ancs_names[cat_name(cat_id)] = [cat_name(anc_id) for anc_id in ancestors(cat_id)]
         
         # Create list of category paths out of dict
         cat_paths = []
@@ -155,7 +264,7 @@ def get_category_paths(prod_id, output='str', restrict=True):
                         cat_paths_str += cat
                     else:
                         cat_paths_str += cat + ' > '
-            return str(cat_paths_str, 'utf-8')
+            return cat_paths_str
         elif output == 'dict':
             return ancs_names
         else:
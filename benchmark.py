@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+End-to-end benchmarks of the exports against the local mock API
+(mock_server.py) with synthetic datasets of fixed sizes (datagen.py).
+
+Stages:
+
+    - products, orders, categories (make_df_full)
+    - make_csv, make_xml (importer)
+
+For each dataset size and stage, the wall time, number of requests, bytes
+transferred, peak RSS and rows/s are measured, along with the time spent in
+fetch (waiting for responses), parse (json decoding), transform (building
+rows and DataFrames, joining orders and rendering items) and write (csv/xml
+output). Each part is timed directly, and fetching overlaps with the other
+parts (prefetching, sharded threads), so they can add up to more than the
+wall time. Each stage runs in a fresh process, so peak RSS is measured per
+stage.
+
+Usage:
+
+    python benchmark.py --sizes 1000,10000 --output bench.json
+    python benchmark.py --sizes 1000,10000 --baseline bench.json
+
+@author: amagrabi
+
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+
+
+STAGES = ['products', 'orders', 'categories', 'make_csv', 'make_xml']
+
+# Metrics where larger values are better (all others: smaller is better)
+HIGHER_IS_BETTER = ['rows_per_s']
+
+
+def _serve(nr_products, nr_orders, latency, seed, queue, stop):
+    '''Runs the mock API in a separate process until stop is set.
+
+    '''
+    from datagen import Dataset
+    from mock_server import MockServer
+
+    dataset = Dataset(nr_products, nr_orders, seed=seed)
+    server = MockServer(dataset, latency=latency, seed=seed).start()
+    queue.put((server.url, server.project_key))
+    stop.wait()
+    server.stop()
+
+
+def _use_mock_api(url, project_key):
+    '''Points config (and thereby all modules) to the mock API.
+
+    '''
+    try:
+        import config
+    except ImportError:
+        config = types.ModuleType('config')
+        sys.modules['config'] = config
+    config.PROJECT_KEY = project_key
+    config.CLIENT_ID = 'benchmark'
+    config.CLIENT_SECRET = 'benchmark'
+    config.SCOPE = 'manage_project:{}'.format(project_key)
+    config.HOST = 'BENCHMARK'
+
+    import api
+    api.register_host(config.HOST, url, url)
+
+
+class Timer(object):
+    '''Cumulated time and calls of wrapped functions.
+
+    '''
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def wrap(self, function, count_rows=None):
+        def wrapped(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.time() - start
+                with self._lock:
+                    self.seconds += seconds
+                    self.calls += 1
+                    if count_rows is not None:
+                        self.rows += count_rows(*args)
+        return wrapped
+
+
+def _run_stage(stage, url, project_key, workdir, queue):
+    '''Runs one stage in the current (fresh) process and reports its metrics.
+
+    '''
+    os.chdir(workdir)
+    sys.stdout = open(os.devnull, 'w')    # progress messages of the exports
+    _use_mock_api(url, project_key)
+
+    import pandas as pd
+    import api
+    import feed
+    import importer
+    import make_df_full
+    import records
+
+    # Time spent writing output files
+    writes = Timer()
+    pd.DataFrame.to_csv = writes.wrap(pd.DataFrame.to_csv, lambda df, *args: len(df))
+    feed.CatalogWriter.write = writes.wrap(feed.CatalogWriter.write, lambda *args: 1)
+    feed.CatalogWriter.close = writes.wrap(feed.CatalogWriter.close)
+
+    # Time spent turning responses into rows, DataFrames and items (the
+    # functions are looked up at call time, and none calls another one)
+    transforms = Timer()
+    for name in ['add_products', 'add_customers', 'add_orders', 'add_categories']:
+        setattr(records, name, transforms.wrap(getattr(records, name)))
+    for name in ['to_df', 'to_typed', 'records']:
+        setattr(records.ColumnBuffer, name, transforms.wrap(getattr(records.ColumnBuffer, name)))
+    for name in ['_purchases', '_render_slice', '_finish_slice']:
+        setattr(importer, name, transforms.wrap(getattr(importer, name)))
+
+    api.reset_stats()
+    start = time.time()
+    if stage == 'products':
+        rows = len(make_df_full.products(verbose=False))
+    elif stage == 'orders':
+        rows = len(make_df_full.orders(verbose=False))
+    elif stage == 'categories':
+        rows = len(make_df_full.categories(verbose=False))
+    elif stage == 'make_csv':
+        importer.make_csv()
+        rows = writes.rows
+    elif stage == 'make_xml':
+        importer.make_xml('www.benchmark.com', verbose=sys.maxsize)
+        rows = writes.rows
+    else:
+        raise Exception('Stage is unknown (has to be one of {}).'.format(STAGES))
+    wall = time.time() - start
+    stats = api.get_stats()
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss/2**20 if platform.system() == 'Darwin' else rss/2**10
+
+    queue.put({'wall': wall,
+               'fetch': stats['time_fetch'],
+               'parse': stats['time_parse'],
+               'write': writes.seconds,
+               'transform': transforms.seconds,
+               'requests': stats['requests'],
+               'logins': stats['logins'],
+               'bytes': stats['bytes'],
+               'peak_rss_mb': rss_mb,
+               'rows': rows,
+               'rows_per_s': rows/wall if wall > 0 else 0.0})
+
+
+def run(sizes, stages=STAGES, orders_per_product=1.0, latency=0.0, seed=0,
+        verbose=True):
+    '''Runs all stages for all dataset sizes.
+
+    Args:
+        sizes: List of numbers of products.
+        stages: Stages to run.
+        orders_per_product: Number of orders per product.
+        latency: Latency of the mock API per request in seconds.
+        seed: Random seed of the datasets.
+        verbose: Flag to print results in the terminal.
+
+    Returns:
+        List of results (dictionaries with size, stage and metrics).
+
+    '''
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for size in sizes:
+        nr_orders = int(size*orders_per_product)
+        queue = context.Queue()
+        stop = context.Event()
+        server = context.Process(target=_serve,
+                                 args=(size, nr_orders, latency, seed, queue, stop))
+        server.start()
+        url, project_key = queue.get()
+        workdir = tempfile.mkdtemp(prefix='benchmark-')
+        try:
+            for stage in stages:
+                process = context.Process(target=_run_stage,
+                                          args=(stage, url, project_key, workdir, queue))
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    raise Exception('Stage {} failed for size {}.'.format(stage, size))
+                result = {'size': size, 'orders': nr_orders, 'stage': stage}
+                result.update(queue.get())
+                results.append(result)
+                if verbose:
+                    print(format_result(result))
+        finally:
+            stop.set()
+            server.join()
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def format_result(result):
+    return ('{size:>8} {stage:<10} wall {wall:8.2f}s (fetch {fetch:.2f}s, '
+            'parse {parse:.2f}s, transform {transform:.2f}s, write {write:.2f}s)  '
+            'requests {requests:>6}  MB {mb:8.1f}  peak RSS {peak_rss_mb:7.1f} MB  '
+            'rows/s {rows_per_s:10.0f}').format(mb=result['bytes']/2**20, **result)
+
+
+def compare(results, baseline, threshold=0.1, metrics=['wall', 'peak_rss_mb', 'rows_per_s']):
+    '''Compares results with a baseline.
+
+    Args:
+        results: List of results of run().
+        baseline: List of results of a previous run.
+        threshold: Relative change of a metric which counts as regression.
+        metrics: Metrics to compare.
+
+    Returns:
+        List of regressions (dictionaries with size, stage, metric, baseline
+        and current value, and relative change).
+
+    '''
+    previous = {(result['size'], result['stage']): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get((result['size'], result['stage']))
+        if base is None:
+            continue
+        for metric in metrics:
+            if not base.get(metric):
+                continue
+            change = (result[metric] - base[metric])/base[metric]
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > threshold:
+                regressions.append({'size': result['size'], 'stage': result['stage'],
+                                    'metric': metric, 'baseline': base[metric],
+                                    'current': result[metric], 'change': change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the exports against the mock API')
+    parser.add_argument('--sizes', default='1000,10000',
+                        help='Comma-separated numbers of products')
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--orders-per-product', type=float, default=1.0)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Latency of the mock API per request in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Json file for the results')
+    parser.add_argument('--baseline', default=None, help='Json file of previous results')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative change which counts as regression')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    stages = args.stages.split(',')
+    results = run(sizes, stages, args.orders_per_product, args.latency, args.seed)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'latency': args.latency,
+                       'seed': args.seed,
+                       'results': results}, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print('REGRESSION {size} {stage} {metric}: {baseline:.2f} -> {current:.2f} ({change:+.0%})'.format(**regression))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
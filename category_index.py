@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+In-memory index of the category tree, built once from a full category fetch
+(make_df_full.categories). Category names, parents and ancestor chains are
+resolved locally, so category paths of products need no further API calls.
+
+@author: amagrabi
+
+"""
+
+import make_df_full
+
+
+class CategoryIndex(object):
+    '''Category names per language, parents and ancestor chains by category id.
+
+    Args:
+        names: Dictionary {language: {category id: name}}.
+        parents: Dictionary {category id: parent id ('' for root categories)}.
+
+    '''
+
+    def __init__(self, names, parents):
+        self.names = names
+        self.parents = parents
+        self._ancestors = {}
+        for cat_id in parents:
+            self.ancestors(cat_id)
+
+    @classmethod
+    def from_df(cls, df_categories, languages=['en','de']):
+        '''Builds the index from a DataFrame of categories.
+
+        Args:
+            df_categories: DataFrame as returned by make_df_full.categories.
+            languages: Languages of category names to index.
+
+        Returns:
+            CategoryIndex.
+
+        '''
+        ids = df_categories['id'].tolist()
+        names = {}
+        for language in languages:
+            names[language] = dict(zip(ids, df_categories['name_' + language].tolist()))
+        parents = {cat_id: parent_id if isinstance(parent_id, str) else ''
+                   for cat_id, parent_id in zip(ids, df_categories['parentId'].tolist())}
+        return cls(names, parents)
+
+    @classmethod
+    def fetch(cls, languages=['en','de'], size_chunks=250, verbose=True):
+        '''Queries all categories via the commercetools API and builds the index.
+
+        Args:
+            languages: Languages of category names to index.
+            size_chunks: Number of categories per request.
+            verbose: Flag to print progress in the terminal.
+
+        Returns:
+            CategoryIndex.
+
+        '''
+        df_categories = make_df_full.categories(size_chunks=size_chunks,
+                                                languages=languages,
+                                                verbose=verbose)
+        return cls.from_df(df_categories, languages)
+
+    def __len__(self):
+        return len(self.parents)
+
+    def __contains__(self, cat_id):
+        return cat_id in self.parents
+
+    def name(self, cat_id, lang='en'):
+        '''Category name (empty string if unavailable).
+
+        '''
+        name = self.names.get(lang, {}).get(cat_id, '')
+        return name if isinstance(name, str) else ''
+
+    def parent(self, cat_id):
+        '''Parent category id (empty string for root or unknown categories).
+
+        '''
+        return self.parents.get(cat_id, '') or ''
+
+    def ancestors(self, cat_id):
+        '''List of ancestor category ids, starting at the root category.
+
+        '''
+        ancs = self._ancestors.get(cat_id)
+        if ancs is None:
+            # Walk up until a root or an already resolved category is found
+            chain = []
+            seen = set([cat_id])
+            parent = self.parent(cat_id)
+            while parent != '' and parent not in seen:
+                if parent in self._ancestors:
+                    chain.extend(reversed(self._ancestors[parent] + [parent]))
+                    break
+                chain.append(parent)
+                seen.add(parent)
+                parent = self.parent(parent)
+            ancs = list(reversed(chain))
+            self._ancestors[cat_id] = ancs
+        return list(ancs)
+
+    def path(self, cat_id, lang='en'):
+        '''Category path as list of names, starting at the root category.
+
+        '''
+        return [self.name(anc_id, lang) for anc_id in self.ancestors(cat_id)] + \
+               [self.name(cat_id, lang)]
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Checkpoints of full exports (see make_df_full), so an interrupted export can
+be resumed instead of fetching everything again.
+
+A checkpoint is a directory with the parameters of the export and one
+append-only log per shard. After each page, the rows converted from the page
+(a column buffer) are appended to the log of its shard together with the
+last id of the page. A resumed export restores the rows of each shard and
+continues its keyset pagination after that id, which yields the same rows as
+an uninterrupted run. A partially written last record (e.g. of a killed
+process) is discarded.
+
+Usage:
+
+    df = make_df_full.orders(checkpoint=True)
+    # ... interrupted, then:
+    df = make_df_full.orders(checkpoint=True, resume=True)
+
+@author: amagrabi
+
+"""
+
+import json
+import os
+import pickle
+import shutil
+import time
+
+
+# Seconds between forced writes of the logs to disk (the logs are flushed
+# after each page, so they survive a crash of the process in any case)
+SYNC_INTERVAL = 10.0
+
+# Errors of reading a partially written record
+TRUNCATED = (EOFError, pickle.UnpicklingError, ValueError)
+
+
+class Checkpoint(object):
+    '''Directory with the progress of an export.
+
+    Args:
+        path: Directory of the checkpoint.
+        signature: Dictionary of the parameters of the export (json
+            serializable), which have to be equal to resume it.
+        resume: Flag to keep the progress of a previous run (otherwise,
+            it is discarded).
+
+    '''
+
+    def __init__(self, path, signature, resume=False):
+        self.path = path
+        self.signature = signature
+        file_signature = os.path.join(path, 'export.json')
+        if resume and os.path.exists(file_signature):
+            with open(file_signature, 'r') as f:
+                previous = json.load(f)
+            if previous != json.loads(json.dumps(signature)):
+                raise Exception('Checkpoint {} belongs to a different export '
+                                '({}).'.format(path, previous))
+        else:
+            self.clear()
+            os.makedirs(path)
+            with open(file_signature + '.tmp', 'w') as f:
+                json.dump(signature, f)
+            os.replace(file_signature + '.tmp', file_signature)
+
+    def shard(self, nr_shard):
+        '''Log of a shard.
+
+        '''
+        return ShardLog(os.path.join(self.path, 'shard-{}.log'.format(nr_shard)))
+
+    def clear(self):
+        '''Removes the checkpoint (e.g. after the export is complete).
+
+        '''
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class ShardLog(object):
+    '''Append-only log of the converted pages of a shard.
+
+    Records are pickled (last id, column buffer) tuples, and None marks a
+    finished shard. The file is only opened when appending, so logs can be
+    passed to worker processes.
+
+    Args:
+        path: Path of the log file.
+
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.finished = False
+        self._file = None
+        self._synced = 0.0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_file'] = None
+        return state
+
+    def load(self):
+        '''Reads the log (and truncates a partially written last record).
+
+        Returns:
+            List of (last id, column buffer) tuples of the logged pages.
+
+        '''
+        pages = []
+        if not os.path.exists(self.path):
+            return pages
+        end = 0
+        with open(self.path, 'rb') as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                except TRUNCATED:
+                    break
+                end = f.tell()
+                if record is None:
+                    self.finished = True
+                else:
+                    pages.append(record)
+        if end < os.path.getsize(self.path):
+            os.truncate(self.path, end)
+        return pages
+
+    def append(self, last_id, buf):
+        '''Logs a page (its last id and its converted rows).
+
+        '''
+        self._write((last_id, buf))
+
+    def finish(self):
+        '''Marks the shard as finished and closes the log.
+
+        '''
+        self._write(None)
+        self.finished = True
+        self._sync()
+        self.close()
+
+    def _write(self, record):
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        # One write per record, so an interruption can only cut the last one
+        self._file.write(pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL))
+        self._file.flush()
+        if time.time() - self._synced > SYNC_INTERVAL:
+            self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._synced = time.time()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
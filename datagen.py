@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Generates seeded synthetic datasets in the json format of the commercetools
+API (for mock_server.py):
+
+    - Products (as Product Projections and Products)
+    - Customers
+    - Orders
+    - Categories (tree with configurable depth)
+
+Only ids and modification dates are kept in memory; items are generated on
+demand from the seed and their position, so datasets with 1M products and
+orders stay small and every run with the same seed returns the same data.
+
+@author: amagrabi
+
+"""
+
+import bisect
+import datetime
+import random
+import uuid
+
+
+DATE_START = datetime.datetime(2017, 1, 1)
+
+WORDS = ['alpine', 'basic', 'classic', 'cotton', 'denim', 'eco', 'fleece',
+         'golden', 'heritage', 'linen', 'merino', 'nordic', 'organic', 'retro',
+         'silk', 'sport', 'summer', 'urban', 'vintage', 'winter']
+NOUNS = ['bag', 'belt', 'boots', 'cap', 'coat', 'dress', 'gloves', 'hoodie',
+         'jacket', 'jeans', 'scarf', 'shirt', 'shoes', 'shorts', 'skirt',
+         'socks', 'sweater', 'trousers', 'vest', 'watch']
+FIRST_NAMES = ['Anna', 'Ben', 'Clara', 'David', 'Emma', 'Felix', 'Greta',
+               'Hannah', 'Jonas', 'Lena', 'Lukas', 'Mia', 'Noah', 'Paul', 'Sophie']
+LAST_NAMES = ['Becker', 'Fischer', 'Hoffmann', 'Koch', 'Meyer', 'Miller',
+              'Schmidt', 'Schneider', 'Smith', 'Wagner', 'Weber', 'Wolf']
+COUNTRIES = {'USD': 'US', 'EUR': 'DE'}
+
+
+def date_str(seconds):
+    '''Date (seconds after DATE_START) in the format of the API.
+
+    '''
+    date = DATE_START + datetime.timedelta(seconds=seconds)
+    return date.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def ref(type_id, item_id):
+    return {'typeId': type_id, 'id': item_id}
+
+
+class Dataset(object):
+    '''Synthetic dataset of products, customers, orders and categories.
+
+    Args:
+        nr_products: Number of products.
+        nr_orders: Number of orders.
+        nr_customers: Number of customers (default: nr_orders/4).
+        nr_categories: Number of categories (default: about nr_products/50).
+        depth: Depth of the category tree.
+        seed: Random seed.
+        languages: Languages of localized fields.
+        currencies: Currencies of prices.
+
+    '''
+
+    entities = ['products', 'customers', 'orders', 'categories']
+
+    def __init__(self, nr_products=1000, nr_orders=1000, nr_customers=None,
+                 nr_categories=None, depth=4, seed=0, languages=['en','de'],
+                 currencies=['USD','EUR']):
+        if nr_customers is None:
+            nr_customers = max(1, nr_orders//4)
+        if nr_categories is None:
+            nr_categories = min(max(depth, nr_products//50), 5000)
+        self.seed = seed
+        self.depth = depth
+        self.languages = languages
+        self.currencies = currencies
+        self.sizes = {'products': nr_products, 'customers': nr_customers,
+                      'orders': nr_orders, 'categories': nr_categories}
+
+        rnd = random.Random(seed)
+        # Ids in order of creation and the position of each id in id order
+        self.ids = {}
+        self.order = {}
+        self.positions = {}
+        self.sorted_ids = {}
+        self.modified = {}
+        for entity in self.entities:
+            ids = [str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+                   for i in range(self.sizes[entity])]
+            self.ids[entity] = ids
+            self.order[entity] = sorted(range(len(ids)), key=ids.__getitem__)
+            self.sorted_ids[entity] = [ids[i] for i in self.order[entity]]
+            self.positions[entity] = {item_id: i for i, item_id in enumerate(ids)}
+            self.modified[entity] = [None]*len(ids)
+        self.versions = {entity: {} for entity in self.entities}
+        self.deleted = {entity: set() for entity in self.entities}
+
+        self._make_tree(rnd)
+
+    def _make_tree(self, rnd):
+        # Categories are spread over the levels of the tree (twice as many on
+        # each deeper level); each one gets a random parent on the level above
+        nr_categories = self.sizes['categories']
+        depth = max(1, min(self.depth, nr_categories))
+        weights = [2**level for level in range(depth)]
+        sizes = [max(1, nr_categories*weight//sum(weights)) for weight in weights]
+        sizes[-1] += max(0, nr_categories - sum(sizes))
+        while sum(sizes) > nr_categories:
+            sizes[sizes.index(max(sizes))] -= 1
+        self.parents = []
+        start = 0
+        for level, size in enumerate(sizes):
+            for i in range(start, start + size):
+                if level == 0:
+                    self.parents.append(None)
+                else:
+                    self.parents.append(rnd.randrange(start - sizes[level-1], start))
+            start += size
+        self.leaves = list(range(nr_categories - sizes[-1], nr_categories))
+
+    def _random(self, entity, i):
+        return random.Random('{}-{}-{}'.format(self.seed, entity, i))
+
+    def _dates(self, entity, i, rnd):
+        created = rnd.randrange(0, 365*24*3600)
+        modified = created + rnd.randrange(0, 30*24*3600)
+        if self.modified[entity][i] is not None:
+            modified = self.modified[entity][i]
+        return date_str(created), date_str(modified)
+
+    def _localized(self, text):
+        return {language: '{} ({})'.format(text, language) for language in self.languages}
+
+    def count(self, entity):
+        return len(self.ids[entity]) - len(self.deleted[entity])
+
+    def index(self, entity, item_id):
+        '''Position of an item in order of creation (None if unknown).
+
+        '''
+        i = self.positions[entity].get(item_id)
+        if i is None or i in self.deleted[entity]:
+            return None
+        return i
+
+    def bounds(self, entity, lower=None, upper=None, inclusive=True):
+        '''Slice of the id order (self.order) with all items within an id range.
+
+        Args:
+            entity: Entity type.
+            lower: Lower bound of ids.
+            upper: Upper bound of ids (exclusive).
+            inclusive: Flag to include the lower bound.
+
+        Returns:
+            Tuple (start, stop).
+
+        '''
+        sorted_ids = self.sorted_ids[entity]
+        start = 0
+        if lower is not None:
+            bisect_lower = bisect.bisect_left if inclusive else bisect.bisect_right
+            start = bisect_lower(sorted_ids, lower)
+        stop = len(sorted_ids)
+        if upper is not None:
+            stop = max(start, bisect.bisect_left(sorted_ids, upper))
+        return start, stop
+
+    def last_modified(self, entity, i):
+        '''lastModifiedAt of an item (without generating the whole item).
+
+        '''
+        return self._dates(entity, i, self._random(entity, i))[1]
+
+    def touch(self, entity, item_id, seconds=None):
+        '''Marks an item as modified (new version and lastModifiedAt).
+
+        '''
+        i = self.positions[entity][item_id]
+        self.modified[entity][i] = 400*24*3600 if seconds is None else seconds
+        self.versions[entity][i] = self.versions[entity].get(i, 1) + 1
+
+    def delete(self, entity, item_id):
+        self.deleted[entity].add(self.positions[entity][item_id])
+
+    def item(self, entity, i):
+        '''Item in the json format of the API, by its position in order of creation.
+
+        '''
+        make = {'products': self._product, 'customers': self._customer,
+                'orders': self._order, 'categories': self._category}[entity]
+        return make(i)
+
+    def _product(self, i):
+        rnd = self._random('products', i)
+        created, modified = self._dates('products', i, rnd)
+        name = '{} {}'.format(rnd.choice(WORDS), rnd.choice(NOUNS))
+        cats = rnd.sample(self.leaves, min(len(self.leaves), rnd.choice([1, 1, 2])))
+        prices = []
+        for currency in self.currencies:
+            cent_amount = rnd.randrange(500, 50000)
+            prices.append({'value': {'currencyCode': currency, 'centAmount': cent_amount}})
+            if rnd.random() < 0.3:
+                prices.append({'value': {'currencyCode': currency,
+                                         'centAmount': cent_amount*9//10},
+                               'country': COUNTRIES.get(currency, 'US')})
+        return {'id': self.ids['products'][i],
+                'version': self.versions['products'].get(i, 1),
+                'createdAt': created,
+                'lastModifiedAt': modified,
+                'productType': ref('product-type', 'mock-product-type'),
+                'name': self._localized(name),
+                'slug': self._localized('{}-{}'.format(name.replace(' ', '-'), i)),
+                'description': self._localized('Description of {}'.format(name)),
+                'categories': [ref('category', self.ids['categories'][c]) for c in cats],
+                'masterVariant': {'id': 1,
+                                  'sku': 'SKU-{:07d}'.format(i),
+                                  'prices': prices,
+                                  'images': [{'url': 'https://img.example.com/{}.jpg'.format(i),
+                                              'dimensions': {'w': 800, 'h': 800}}],
+                                  'attributes': []},
+                'variants': [],
+                'published': True,
+                'hasStagedChanges': False}
+
+    def product(self, i):
+        '''Product (not projection) with current and staged data.
+
+        '''
+        projection = self._product(i)
+        data = {key: projection[key] for key in
+                ['name', 'slug', 'description', 'categories', 'masterVariant', 'variants']}
+        return {'id': projection['id'],
+                'version': projection['version'],
+                'createdAt': projection['createdAt'],
+                'lastModifiedAt': projection['lastModifiedAt'],
+                'productType': projection['productType'],
+                'masterData': {'current': data, 'staged': data,
+                               'published': True, 'hasStagedChanges': False}}
+
+    def _customer(self, i):
+        rnd = self._random('customers', i)
+        created, modified = self._dates('customers', i, rnd)
+        first_name = rnd.choice(FIRST_NAMES)
+        last_name = rnd.choice(LAST_NAMES)
+        customer = {'id': self.ids['customers'][i],
+                    'version': self.versions['customers'].get(i, 1),
+                    'createdAt': created,
+                    'lastModifiedAt': modified,
+                    'firstName': first_name,
+                    'lastName': last_name,
+                    'email': '{}.{}.{}@example.com'.format(first_name, last_name, i).lower(),
+                    'addresses': []}
+        if rnd.random() < 0.2:
+            customer['customerGroup'] = ref('customer-group', 'mock-group-{}'.format(rnd.randrange(3)))
+        return customer
+
+    def _order(self, i):
+        rnd = self._random('orders', i)
+        created, modified = self._dates('orders', i, rnd)
+        currency = rnd.choice(self.currencies)
+        line_items = []
+        for j in range(rnd.choice([1, 1, 1, 2, 2, 3, 4])):
+            product = self._product(rnd.randrange(len(self.ids['products'])))
+            price = [p for p in product['masterVariant']['prices']
+                     if p['value']['currencyCode'] == currency][0]
+            line_items.append({'id': str(uuid.UUID(int=rnd.getrandbits(128), version=4)),
+                               'productId': product['id'],
+                               'name': product['name'],
+                               'variant': {'id': 1, 'sku': product['masterVariant']['sku']},
+                               'price': price,
+                               'quantity': rnd.randrange(1, 4)})
+        total = sum(item['price']['value']['centAmount']*item['quantity'] for item in line_items)
+        order = {'id': self.ids['orders'][i],
+                 'version': self.versions['orders'].get(i, 1),
+                 'createdAt': created,
+                 'lastModifiedAt': modified,
+                 'totalPrice': {'currencyCode': currency, 'centAmount': total},
+                 'country': COUNTRIES.get(currency, 'US'),
+                 'orderState': 'Open',
+                 'lineItems': line_items}
+        if rnd.random() < 0.15:
+            order['anonymousId'] = str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+        else:
+            customer = rnd.randrange(len(self.ids['customers']))
+            order['customerId'] = self.ids['customers'][customer]
+            order['customerEmail'] = 'customer.{}@example.com'.format(customer)
+        return order
+
+    def _category(self, i):
+        rnd = self._random('categories', i)
+        created, modified = self._dates('categories', i, rnd)
+        name = '{} {}'.format(rnd.choice(WORDS), rnd.choice(NOUNS)).title()
+        ancestors = []
+        parent = self.parents[i]
+        while parent is not None:
+            ancestors.insert(0, ref('category', self.ids['categories'][parent]))
+            parent = self.parents[parent]
+        category = {'id': self.ids['categories'][i],
+                    'version': self.versions['categories'].get(i, 1),
+                    'createdAt': created,
+                    'lastModifiedAt': modified,
+                    'name': self._localized(name),
+                    'slug': self._localized('{}-{}'.format(name.lower().replace(' ', '-'), i)),
+                    'ancestors': ancestors,
+                    'orderHint': '0.{}'.format(i)}
+        if self.parents[i] is not None:
+            category['parent'] = ref('category', self.ids['categories'][self.parents[i]])
+        return category
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Incremental writer for product catalogs in the Beveel (Google Shopping RSS)
+format. Items are serialized one by one as they are produced, with the g:
+namespace declared once on the root element, so the feed is written in a
+single pass and memory use does not depend on the catalog size.
+
+Very large catalogs can be split into shards by number of items or size 
+(ShardedCatalogWriter), each a complete feed and optionally compressed with 
+gzip, with a manifest listing the shards and their sha256 checksums.
+
+@author: amagrabi
+
+"""
+
+import gzip
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from xml.sax.saxutils import escape
+
+
+NS_G = 'http://base.google.com/ns/1.0'
+
+INDENT = '  '
+
+# Characters which are not allowed in XML 1.0 (C0 controls other than tab,
+# newline and carriage return, and the non-characters U+FFFE and U+FFFF)
+INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+# Compression level of gzip-compressed feeds (1: fastest, 9: smallest)
+COMPRESS_LEVEL = 6
+
+# Version of the item layout of product_item (cached items of other versions
+# are rendered again, see fragment_cache.py)
+ITEM_FORMAT = 2
+
+
+def to_text(value):
+    '''Converts a field value to text (empty string for missing values).
+
+    Characters which are not allowed in XML are removed, so the feed stays
+    well-formed.
+
+    '''
+    if value is None:
+        return ''
+    if isinstance(value, float) and math.isnan(value):
+        return ''
+    return INVALID_CHARS.sub('', str(value))
+
+
+def price_text(cents):
+    '''Converts a price in cents to the text of a price field.
+
+    '''
+    price = cents/100
+    price = round(price,2)
+    return str(price)
+
+
+def render_element(tag, value, depth):
+    '''Serializes an element with text (str) or child elements (list of
+    (tag, value) tuples), indented for the given depth.
+
+    '''
+    indent = INDENT*depth
+    if isinstance(value, list):
+        children = ''.join(render_element(child_tag, child_value, depth+1)
+                           for child_tag, child_value in value)
+        return '{0}<{1}>\n{2}{0}</{1}>\n'.format(indent, tag, children)
+    return '{0}<{1}>{2}</{1}>\n'.format(indent, tag, escape(to_text(value)))
+
+
+def render_item(fields):
+    '''Serializes a catalog item.
+
+    Args:
+        fields: List of (tag, value) tuples, where value is a text or a list
+            of (tag, value) tuples of child elements.
+
+    Returns:
+        Serialized <item> element (utf-8 bytes).
+
+    '''
+    return render_element('item', fields, 2).encode('utf-8')
+
+
+def product_item(product, product_type):
+    '''Serializes a product as catalog item.
+
+    Args:
+        product: Mapping with the product fields id, sku, name_en, price_USD
+            and img (e.g. a row of make_df_full.products).
+        product_type: Category path of the product.
+
+    Returns:
+        Serialized <item> element (utf-8 bytes).
+
+    '''
+    price = price_text(product['price_USD'])
+    fields = [('g:item_group_id', product['id']),
+              ('g:id', product['sku']),
+              ('g:title', product['name_en']),
+              ('g:product_type', product_type),
+              ('g:brand', ''),
+              ('g:price', price),
+              ('g:sale_price', price),
+              ('g:availability', ''),
+              ('g:link', ''),
+              ('g:gender', ''),
+              ('g:image_link', product['img']),
+              ('g:installment', [('g:months', ''),
+                                 ('g:amount', '')])]
+    return render_item(fields)
+
+
+def render_items(products, product_types):
+    '''Serializes products as catalog items (e.g. in a worker process).
+
+    Args:
+        products: List of mappings with the product fields (see product_item).
+        product_types: List of category paths of the products.
+
+    Returns:
+        List of serialized <item> elements (utf-8 bytes).
+
+    '''
+    return [product_item(product, product_type)
+            for product, product_type in zip(products, product_types)]
+
+
+class CatalogWriter(object):
+    '''Writes a catalog feed incrementally (use as context manager).
+
+    On close(), the manifest and the shards of a previous sharded run at
+    path (see ShardedCatalogWriter) are removed, so they cannot be
+    published instead of the new feed.
+
+    Args:
+        path: Output file.
+        title: Title of the channel (e.g. the project key).
+        link: Link to the shop website.
+
+    '''
+
+    def __init__(self, path, title, link):
+        self.path = path
+        self.title = title
+        self.link = link
+        self.manifest = os.path.splitext(path)[0] + '.manifest.json'
+        self.nr_items = 0
+        self._f = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self):
+        # Write to a temporary file, which replaces the output file on close()
+        self._f = open(self.path + '.tmp', 'wb')
+        self._f.write(self.header())
+
+    def header(self):
+        return ('<rss xmlns:g="{}" version="2.0">\n'.format(NS_G) +
+                INDENT + '<channel>\n' +
+                render_element('title', self.title, 2) +
+                render_element('link', self.link, 2)).encode('utf-8')
+
+    def footer(self):
+        return (INDENT + '</channel>\n</rss>\n').encode('utf-8')
+
+    def write(self, item):
+        '''Writes a serialized item (from render_item or product_item).
+
+        '''
+        self._f.write(item)
+        self.nr_items += 1
+
+    def close(self):
+        if self._f is not None:
+            self._f.write(self.footer())
+            self._f.close()
+            self._f = None
+            os.replace(self.path + '.tmp', self.path)
+            # Feed of a previous sharded run (manifest first, so it never
+            # lists missing shards)
+            previous = self._manifest_files()
+            if os.path.exists(self.manifest):
+                os.remove(self.manifest)
+            self._remove_shards(previous)
+
+    def _manifest_files(self):
+        # Shards listed in the manifest of the previous feed
+        if not os.path.exists(self.manifest):
+            return set()
+        with open(self.manifest, 'r') as f:
+            return set(shard['file'] for shard in json.load(f)['shards'])
+
+    def _remove_shards(self, names):
+        for name in names:
+            path = os.path.join(os.path.dirname(self.manifest), name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def abort(self):
+        '''Discards the partially written feed.
+
+        '''
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+            os.remove(self.path + '.tmp')
+
+
+class ShardedCatalogWriter(CatalogWriter):
+    '''Writes a catalog feed split into shards (use as context manager).
+
+    Each shard is a complete feed, named after path with the id of the run
+    and the number of the shard (e.g. catalog-20170601120000000-00001.xml,
+    or ...-00001.xml.gz if compressed). The manifest (e.g.
+    catalog.manifest.json) lists the shards with their number of items, size
+    and sha256 checksum. As the shards of a run never replace files of the
+    previous feed, the manifest always matches the files it lists: on
+    close(), the shards are completed first, then the manifest is replaced,
+    and then the shards of the previous manifest (and a single-file feed
+    of a previous unsharded run at path) are removed.
+
+    Args:
+        path: Output file (name of the shards and the manifest).
+        title: Title of the channel (e.g. the project key).
+        link: Link to the shop website.
+        max_items: Maximum number of items per shard (default: no limit).
+        max_bytes: Maximum size of a shard in bytes, before compression
+            (default: no limit). Shards hold at least one item.
+        compress: Flag to compress the shards with gzip.
+
+    '''
+
+    def __init__(self, path, title, link, max_items=None, max_bytes=None,
+                 compress=False):
+        super(ShardedCatalogWriter, self).__init__(path, title, link)
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.root, self.ext = os.path.splitext(path)
+        self.run = None
+        self.shards = []
+        self._file = None
+        self._size = 0
+
+    def shard_path(self, nr_shard):
+        return '{}-{}-{:05d}{}{}'.format(self.root, self.run, nr_shard, self.ext,
+                                         '.gz' if self.compress else '')
+
+    def open(self):
+        # Id of the run (UTC time in milliseconds), unique per feed
+        now = time.time()
+        self.run = '{}{:03d}'.format(time.strftime('%Y%m%d%H%M%S', time.gmtime(now)),
+                                     int(now*1000) % 1000)
+        self.shards = []
+        self._open_shard()
+
+    def _open_shard(self):
+        path = self.shard_path(len(self.shards) + 1)
+        self._file = _HashingFile(open(path + '.tmp', 'wb'))
+        if self.compress:
+            # mtime=0, so equal feeds have equal checksums
+            self._f = gzip.GzipFile(fileobj=self._file, mode='wb', mtime=0,
+                                    compresslevel=COMPRESS_LEVEL)
+        else:
+            self._f = self._file
+        header = self.header()
+        self._f.write(header)
+        self._size = len(header) + len(self.footer())
+        self.shards.append({'file': os.path.basename(path), 'items': 0})
+
+    def write(self, item):
+        '''Writes a serialized item (into a new shard if the current one is full).
+
+        '''
+        shard = self.shards[-1]
+        full = (self.max_items is not None and shard['items'] >= self.max_items) or \
+               (self.max_bytes is not None and self._size + len(item) > self.max_bytes)
+        if full and shard['items'] > 0:
+            self._close_shard()
+            self._open_shard()
+            shard = self.shards[-1]
+        self._f.write(item)
+        shard['items'] += 1
+        self._size += len(item)
+        self.nr_items += 1
+
+    def _close_shard(self):
+        self._f.write(self.footer())
+        if self.compress:
+            self._f.close()
+        self._file.close()
+        shard = self.shards[-1]
+        shard['bytes'] = self._file.size
+        shard['sha256'] = self._file.sha256.hexdigest()
+        self._f = None
+        self._file = None
+
+    def close(self):
+        if self._f is None:
+            return
+        self._close_shard()
+        previous = self._manifest_files()
+        for nr_shard in range(1, len(self.shards) + 1):
+            path = self.shard_path(nr_shard)
+            os.replace(path + '.tmp', path)
+        with open(self.manifest + '.tmp', 'w') as f:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                       'title': self.title,
+                       'items': self.nr_items,
+                       'compressed': self.compress,
+                       'shards': self.shards}, f, indent=2)
+        os.replace(self.manifest + '.tmp', self.manifest)
+        current = set(shard['file'] for shard in self.shards)
+        self._remove_shards(previous - current)
+        if os.path.exists(self.path):
+            # Feed of a previous unsharded run
+            os.remove(self.path)
+
+    def abort(self):
+        '''Discards the partially written feed (the previous feed is kept).
+
+        '''
+        if self._f is not None:
+            if self.compress:
+                self._f.close()
+            self._file.close()
+            self._f = None
+            self._file = None
+        for nr_shard in range(1, len(self.shards) + 1):
+            path = self.shard_path(nr_shard) + '.tmp'
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class _HashingFile(object):
+    # Writes to a file and computes the size and sha256 checksum of the
+    # written bytes
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._f.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
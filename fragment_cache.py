@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Cache of serialized catalog items (see importer.make_xml), so feeds of
+mostly unchanged catalogs are assembled from the items of the previous run
+instead of rendering every item again.
+
+Items are stored by product id in a SQLite file, together with the version
+of the product and a fingerprint of the other inputs of the item (e.g. the
+category path, which changes without a new product version when categories
+are renamed, and feed.ITEM_FORMAT). An item is reused if both are unchanged.
+
+Usage:
+
+    fragments = FragmentCache('cache/fragments.db')
+    cached = fragments.get_many(ids)
+    ...
+    fragments.put_many([(id, version, fingerprint, item), ...])
+
+@author: amagrabi
+
+"""
+
+import hashlib
+import os
+import sqlite3
+
+
+# Maximum number of ids per query (SQLite limits the number of parameters)
+BATCH_SIZE = 500
+
+
+def fingerprint(*parts):
+    '''Short hash of strings (e.g. the category path of a product).
+
+    '''
+    return hashlib.sha1('\x00'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+class FragmentCache(object):
+    '''Serialized items by product id.
+
+    Args:
+        path: Path of the SQLite file.
+
+    '''
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS fragments ('
+                         'id TEXT PRIMARY KEY, version INTEGER, '
+                         'fingerprint TEXT, item BLOB)')
+        self._db.commit()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM fragments').fetchone()[0]
+
+    def get_many(self, ids):
+        '''Cached items of products.
+
+        Args:
+            ids: List of product ids.
+
+        Returns:
+            Dictionary of (version, fingerprint, item) tuples by product id
+            (only ids with a cached item).
+
+        '''
+        cached = {}
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start:start+BATCH_SIZE]
+            rows = self._db.execute('SELECT id, version, fingerprint, item FROM fragments '
+                                    'WHERE id IN ({})'.format(','.join('?'*len(batch))),
+                                    batch)
+            for id_, version, print_, item in rows:
+                cached[id_] = (version, print_, bytes(item))
+        return cached
+
+    def get(self, cached, id_, version, print_):
+        '''Item from the result of get_many() if it is up to date (else None).
+
+        '''
+        entry = cached.get(id_)
+        if entry is None or entry[0] != version or entry[1] != print_:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[2]
+
+    def put_many(self, entries):
+        '''Stores items.
+
+        Args:
+            entries: List of (id, version, fingerprint, item) tuples.
+
+        '''
+        self._db.executemany('INSERT OR REPLACE INTO fragments VALUES (?, ?, ?, ?)',
+                             [(id_, int(version), print_, sqlite3.Binary(item))
+                              for id_, version, print_, item in entries])
+        self._db.commit()
+
+    def retain(self, ids):
+        '''Removes the items of all other products (e.g. deleted ones).
+
+        '''
+        self._db.execute('CREATE TEMP TABLE IF NOT EXISTS retained (id TEXT PRIMARY KEY)')
+        self._db.execute('DELETE FROM retained')
+        self._db.executemany('INSERT OR IGNORE INTO retained VALUES (?)',
+                             [(id_,) for id_ in ids])
+        self._db.execute('DELETE FROM fragments WHERE id NOT IN (SELECT id FROM retained)')
+        self._db.execute('DELETE FROM retained')
+        self._db.commit()
+
+    def clear(self):
+        self._db.execute('DELETE FROM fragments')
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
@@ -10,55 +10,105 @@ exports data to csv (purchases/orders) and xml (product catalog) files.
 """
 
 
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
-from lxml import etree
 
 import config
-import nr
 import make_df_full
+import records
 import api_util
 import text
+import feed
+import sync
+from category_index import CategoryIndex
+from fragment_cache import FragmentCache, fingerprint
 
 import os
 DIR_BASE = os.getcwd()
 DIR_UPLOAD = os.path.join(DIR_BASE, 'upload', config.PROJECT_KEY)
 if not os.path.exists(DIR_UPLOAD):
-    os.mkdir(DIR_UPLOAD)
+    os.makedirs(DIR_UPLOAD)
 FILE_CATALOG = os.path.join(DIR_UPLOAD, 'catalog.xml')
-FILE_CHANGELIST = os.path.join(DIR_BASE, 'changelist.txt')
+FILE_FRAGMENTS = os.path.join(DIR_BASE, 'cache', config.PROJECT_KEY, 'fragments.db')
+
+# Number of products per lookup of cached items
+SIZE_FRAGMENTS = 1000
 
 
-def make_csv():
+def make_csv(incremental=False):
     '''Creates a csv file of all purchases in the Beveel format (shop specified in config.py).
 
+    Args:
+        incremental: Flag to only fetch items modified since the last run 
+            and merge them into local snapshots (see sync.py).
+
     '''
     
-    # Get data via API
-    df_orders = make_df_full.orders()
-    df_products = make_df_full.products(staged='false')
-    
-    # Replace anonymous customer id with order id when there are at least 2 products ordered
-    ind = df_orders['customerId']=='anonymous'
-    order_counts = df_orders.ix[ind, 'orderId'].value_counts()
-    order_ids = order_counts[order_counts>1].index.values.tolist()
+    # Get data via API (full exports stream the orders page by page, only 
+    # the skus of the products are kept)
+    if incremental:
+        df_orders = sync.orders()
+        df_products = sync.products(staged='false')
+        skus = _skus([df_products])
+        pages = [df_orders]
+    else:
+        skus = _skus(make_df_full.stream_products(staged='false'))
+        pages = make_df_full.stream_orders()
     
-    ind = df_orders['orderId'].isin(order_ids)
-    df_orders.ix[ind, 'customerId'] = df_orders.ix[ind, 'orderId']
+    # Write purchases page by page (all line items of an order are in the 
+    # same page), continuing the row index of the previous pages
+    FILE_PURCHASES = os.path.join(DIR_UPLOAD, 'purchases.csv')
+    with open(FILE_PURCHASES, 'w') as f:
+        header = True
+        nr_rows = 0
+        for df_orders in pages:
+            df_purchases = _purchases(df_orders, skus)
+            df_purchases.index += nr_rows
+            df_purchases.to_csv(f, header=header)
+            header = False
+            nr_rows += len(df_purchases)
+        if header:
+            # No orders at all, only write the header
+            _purchases(records.orders_buffer().to_df(), skus).to_csv(f)
 
-    # Delete remaining anonymous rows (with <1 products ordered)    
-    df_orders = df_orders.ix[df_orders['customerId']!='anonymous']
-    df_orders = df_orders.reset_index(drop=True)
+
+def _skus(pages):
+    # Skus by product id (first one if an id occurs twice)
+    skus = [pd.Series(df['sku'].values, index=df['id'].values) for df in pages]
+    skus = pd.concat(skus) if len(skus) > 0 else pd.Series([], dtype=object)
+    return skus[~skus.index.duplicated(keep='first')]
+
+
+def _purchases(df_orders, skus):
+    '''Converts orders (one row per line item) into purchases in the Beveel format.
     
-    # Identify skus from df_products in df_orders
-    df_orders['sku'] = -1
-    df_orders_new = pd.DataFrame(index=[])
-    for i in range(len(df_orders)):
-        product_id = df_orders.loc[i, 'productId']
-        if product_id in df_products.id.values:
-            ind = df_products.id[df_products.id == product_id].index[0]
-            df_orders.ix[i, 'sku'] = df_products.ix[ind, 'sku']
-            df_orders_new = df_orders_new.append(df_orders.ix[i], ignore_index=True)
-    df_orders = df_orders_new
+    Args:
+        df_orders: DataFrame of orders, all line items of an order included.
+        skus: Series of skus by product id.
+        
+    Returns:
+        DataFrame of purchases.
+        
+    '''
+    
+    # Replace anonymous customer id with order id when there are at least 2 
+    # products ordered, and delete remaining anonymous rows (with <2 products)
+    anonymous = df_orders['customerId'] == 'anonymous'
+    order_counts = df_orders.loc[anonymous, 'orderId'].value_counts()
+    multiple = df_orders['orderId'].map(order_counts).fillna(0) > 1
+    customer_ids = df_orders['customerId'].where(~(anonymous & multiple),
+                                                 df_orders['orderId'])
+    
+    # Identify skus of products in df_orders (hash join on product id)
+    known = df_orders['productId'].isin(skus.index)
+    
+    keep = known & (customer_ids != 'anonymous')
+    df_orders = df_orders.loc[keep].copy()
+    df_orders['customerId'] = customer_ids[keep]
+    df_orders['sku'] = df_orders['productId'].map(skus)
+    df_orders = df_orders.reset_index(drop=True)
 
     # Create csv file for purchases
     df_purchases = pd.DataFrame([], 
@@ -71,8 +121,7 @@ def make_csv():
     df_purchases['product_id'] = df_orders['productId']
     df_purchases['sku_id'] = df_orders['sku']
     
-    df_purchases['date_of_purchase'] = \
-        df_orders['createdAt'].apply(lambda x: text.date_to_us(x))
+    df_purchases['date_of_purchase'] = text.dates_to_us(df_orders['createdAt'])
 
     df_purchases['user_id'] = df_orders['customerId']
     
@@ -80,119 +129,163 @@ def make_csv():
     ind = df_orders['currency']=='USD'
     
     # Convert prices (original prices are in cents)
-    df_purchases.ix[ind, 'price'] = df_orders['totalPrice']/100
+    df_purchases.loc[ind, 'price'] = df_orders['totalPrice']/100
 
     df_purchases['sku_currently_in_stock'] = ''
     df_purchases['gender'] = ''
     df_purchases['dob'] = ''
     df_purchases['site'] = ''
     
-    FILE_PURCHASES = os.path.join(DIR_UPLOAD, 'purchases.csv')
-    df_purchases.to_csv(FILE_PURCHASES)
+    return df_purchases
 
         
-def make_xml(website, verbose=1):
+def make_xml(website, verbose=1, incremental=False, fragments=False,
+             processes=None, shard_items=None, shard_bytes=None, compress=False):
     '''Creates a xml file of the product catalog in the Beveel format (shop specified in config.py).
     
     Args:
         website: Link to the shop website.
         verbose: Flag to print progress in the terminal.
+        incremental: Flag to only fetch items modified since the last run 
+            and merge them into local snapshots (see sync.py).
+        fragments: Flag to reuse the items of unchanged products from 
+            previous runs (cached in FILE_FRAGMENTS, see fragment_cache.py).
+        processes: Number of worker processes which render slices of 
+            SIZE_FRAGMENTS products (default: render in this process).
+        shard_items: Maximum number of items per file (the feed is split 
+            into numbered files and a manifest, see feed.ShardedCatalogWriter).
+        shard_bytes: Maximum size of a file in bytes (before compression).
+        compress: Flag to compress the files with gzip.
         
     '''
     
-    nr_products = nr.products(staged='false')
-    df_products = make_df_full.products(nr_products, staged='false')
+    # Category paths come with the products (expanded references) in full 
+    # exports, which are streamed page by page; snapshots are resolved 
+    # locally, as renamed categories do not change the lastModifiedAt of 
+    # their products
+    if incremental:
+        pages = [sync.products(staged='false', verbose=bool(verbose))]
+        index = CategoryIndex.from_df(sync.categories(verbose=bool(verbose)))
+    else:
+        pages = make_df_full.stream_products(staged='false', expand=True)
+        index = None
     
-    root = etree.Element('rss')
-
-    channel = etree.SubElement(root, 'channel')
+    # Write items one by one into the feed (g: namespace declared on <rss>)
+    cols = ['id','sku','name_en','price_USD','img','categoryIds','version']
+    if index is None:
+        cols.append('categoryPath_en')
+    cache = FragmentCache(FILE_FRAGMENTS) if fragments else None
+    if shard_items is None and shard_bytes is None and not compress:
+        writer = feed.CatalogWriter(FILE_CATALOG, config.PROJECT_KEY, website)
+    else:
+        writer = feed.ShardedCatalogWriter(FILE_CATALOG, config.PROJECT_KEY, website,
+                                           shard_items, shard_bytes, compress)
+    with writer:
+        
+        i = 0
+        for item in _items(pages, cols, index, cache, processes):
+            
+            print('--- Adding products to xml: {} ---'.format(i)) if i%verbose==0 else None
+            
+            writer.write(item)
+            i += 1
     
-    title = etree.SubElement(channel, 'title')
-    title.text = config.PROJECT_KEY
+    if cache is not None:
+        if verbose:
+            print('--- Reused items: {} (rendered: {}) ---'.format(cache.hits, cache.misses))
+        cache.close()
+
+
+def _items(pages, cols, index=None, cache=None, processes=None):
+    '''Serialized catalog items of products, in order.
     
-    link = etree.SubElement(channel, 'link')
-    link.text = website
+    Products are processed in slices of SIZE_FRAGMENTS rows: category paths 
+    and cached items are looked up in this process, and the other items are 
+    rendered here or by a pool of worker processes (with up to two slices 
+    per process in flight).
     
-    for i in range(len(df_products)):
-        
-        print('--- Adding products to xml: {} of {} ---'.format(i,len(df_products))) if i%verbose==0 else None
-
-        item = etree.SubElement(channel, 'item')
+    Args:
+        pages: Iterable of DataFrames of products.
+        cols: Columns used for the items.
+        index: CategoryIndex to resolve category paths (default: the 
+            categoryPath_en column).
+        cache: FragmentCache (default: render all items). Items of products 
+            which are not in pages are removed from it at the end.
+        processes: Number of worker processes rendering items.
         
-        g_item_group_id = etree.SubElement(item, 'g_item_group_id')
-        g_item_group_id.text = df_products.ix[i, 'id']
+    Returns:
+        Generator of items (utf-8 bytes).
         
-        g_id = etree.SubElement(item, 'g_id')
-        g_id.text = df_products.ix[i, 'sku']
+    '''
+    executor = None
+    if processes is not None and processes > 1:
+        executor = ProcessPoolExecutor(max_workers=processes)
+    in_flight = 2*processes if executor is not None else 0
+    pending = collections.deque()
+    ids = []
+    try:
+        for df_products in pages:
+            for start in range(0, len(df_products), SIZE_FRAGMENTS):
+                chunk = df_products.iloc[start:start+SIZE_FRAGMENTS]
+                pending.append(_render_slice(chunk, cols, index, cache, executor))
+                if cache is not None:
+                    ids.extend(chunk['id'].tolist())
+                while len(pending) > in_flight:
+                    for item in _finish_slice(pending.popleft(), cache):
+                        yield item
+        while pending:
+            for item in _finish_slice(pending.popleft(), cache):
+                yield item
+    finally:
+        if executor is not None:
+            # Slices still pending if the generator was closed early
+            for _, _, _, _, rendered in pending:
+                if not isinstance(rendered, list):
+                    rendered.cancel()
+            executor.shutdown(wait=True)
+    
+    if cache is not None:
+        # Items of deleted products are not needed anymore
+        cache.retain(ids)
 
-        g_title = etree.SubElement(item, 'g_title')
-        g_title.text = df_products.ix[i, 'name']
 
-        g_product_type = etree.SubElement(item, 'g_product_type')
-        g_product_type.text = api_util.get_category_paths(df_products.ix[i, 'id'], output='str', restrict=True)
+def _render_slice(chunk, cols, index, cache, executor):
+    # Starts rendering the items of a slice of products which are not cached
+    products = [dict(zip(cols, values)) for values in zip(*[chunk[col].tolist() for col in cols])]
+    if index is None:
+        product_types = [product['categoryPath_en'] for product in products]
+    else:
+        product_types = [api_util.get_category_paths(product['id'], output='str', restrict=True,
+                                                     index=index, cats_ids=product['categoryIds'])
+                         for product in products]
+    items = [None]*len(products)
+    prints = None
+    if cache is not None:
+        cached = cache.get_many([product['id'] for product in products])
+        prints = [fingerprint(product_type, str(feed.ITEM_FORMAT)) for product_type in product_types]
+        items = [cache.get(cached, product['id'], product['version'], print_)
+                 for product, print_ in zip(products, prints)]
+    missing = [k for k, item in enumerate(items) if item is None]
+    args = ([products[k] for k in missing], [product_types[k] for k in missing])
+    if executor is not None and len(missing) > 0:
+        rendered = executor.submit(feed.render_items, *args)
+    else:
+        rendered = feed.render_items(*args)
+    return products, prints, items, missing, rendered
 
-        g_brand = etree.SubElement(item, 'g_brand')
-        g_brand.text = '' #str(df_products.ix[i, 'brand'])
-        
-        g_price = etree.SubElement(item, 'g_price')
-        price = df_products.ix[i, 'price_us']/100
-        price = round(price,2)
-        g_price.text = str(price)
-        
-        g_sale_price = etree.SubElement(item, 'g_sale_price')
-        price = df_products.ix[i, 'price_us']/100
-        price = round(price,2)
-        g_sale_price.text = str(price)
-        
-        g_availability = etree.SubElement(item, 'g_availability')
-        g_availability.text = ''
-        
-        g_link = etree.SubElement(item, 'g_link')
-        g_link.text = ''
-        
-        g_gender = etree.SubElement(item, 'g_gender')
-        g_gender.text = ''
-        
-        g_image_link = etree.SubElement(item, 'g_image_link')
-        g_image_link.text = df_products.ix[i, 'img']
-        
-        g_installment = etree.SubElement(item, 'g_installment')
-        g_months = etree.SubElement(g_installment, 'g_months')
-        g_months.text = ''
-        g_amount = etree.SubElement(g_installment, 'g_amount')
-        g_amount.text = ''
-        
-#        g_custom_attribute = etree.SubElement(item, 'g_custom_attribute')
-        
-    
-    # Write to file
-    tree = etree.ElementTree(root)
-    tree.write(FILE_CATALOG, pretty_print=True, xml_declaration=False, encoding='utf-8')
 
-    
-    # Make manual changes (special characters)
-    with open(FILE_CATALOG, 'r') as f:
-        lines = f.readlines()
-        f.close()
-    
-    # Adapt first line
-    lines = lines[1:]
-    lines[0] = '<rss xmlns:g="http://base.google.com/ns/1.0" version="2.0">\n'
-    
-    # Convert html in category path
-#    for i, line in enumerate(lines):
-#        lines[i] = lines[i].replace('&gt;','>')
-    
-    # Write file
-    with open(FILE_CATALOG, 'w') as f:
-        f.writelines(lines)
-        f.close()
-        
-    # Workaround: Change field names to colons (g_gender -> g:gender) via 
-    # static dictionary file, since lxml library does not seem to support
-    # names with colons.
-    text.change_textfile(FILE_CATALOG, FILE_CHANGELIST)
-    
+def _finish_slice(pending, cache):
+    # Waits for the items of a slice (and caches the rendered ones)
+    products, prints, items, missing, rendered = pending
+    if not isinstance(rendered, list):
+        rendered = rendered.result()
+    for k, item in zip(missing, rendered):
+        items[k] = item
+    if cache is not None:
+        cache.put_many([(products[k]['id'], products[k]['version'], prints[k], items[k])
+                        for k in missing])
+    return items
+
 
 if __name__ == "__main__":
     make_csv()
@@ -12,400 +12,616 @@ of the following objects:
     
 Functions always return the whole available data. 
 For querying specific subsets, use functions in make_df.py.
+
+The stream_* functions yield the data page by page (as small DataFrames or 
+lists of records), so consumers can process it while it is being fetched, 
+with memory bounded by the page size.
+
+With shards > 1, the id space is split into ranges of hex id prefixes which 
+are paged concurrently (keyset pagination within each range), and the 
+results are merged in id order, i.e. identical to a sequential export.
+
+Pages are prefetched by a background thread (up to PREFETCH pages ahead), 
+so the next request is sent while the current page is turned into rows. 
+Keyset pagination needs the last id of a page for the next request, so 
+there is still only one request in flight per shard; the overlap is between 
+fetching (and json decoding) and row conversion.
+
+With processes > 1, the shards are fetched, decoded and converted into rows 
+by a pool of worker processes (both steps are pure Python and bound by the 
+GIL), which return column buffers that are concatenated in id order.
+
+With checkpoint=True, the converted pages and the last id of each shard are 
+logged to CHECKPOINT_DIR (see checkpoint.py), and an interrupted export 
+continues from there with resume=True instead of starting from scratch.
     
 @author: amagrabi
 
 
 """
 
-import pandas as pd
+import functools
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import quote
 
+import api
 import config
-from api import login, query
-from api_util import get_product_price
+import records
+from checkpoint import Checkpoint
+from api import cached_login, query
 
 
-def products(staged='false', size_chunks=250, 
-             languages=['en','de'], currencies=['USD','EUR'],
-             verbose=True):
-    '''Queries the commercetools API to create a DataFrame of products.
+# Number of leading hex digits of ids used to split the id space into shards
+PREFIX_DIGITS = 4
+
+# Number of pages fetched ahead of their conversion (0 disables prefetching)
+PREFETCH = 2
+
+# Directory of the checkpoints of exports (one subdirectory per export)
+CHECKPOINT_DIR = 'checkpoints'
+
+# Reference expansion of product categories and their ancestors
+EXPAND_CATEGORIES = '&expand=' + quote('categories[*]') + \
+                    '&expand=' + quote('categories[*].ancestors[*]')
+
+
+def shard_bounds(shards):
+    '''Splits the id space into contiguous ranges of hex id prefixes.
+    
+    Ids are UUIDs, so all ranges hold roughly the same number of items.
     
     Args:
-        nr_items: Maximum number of retrieved items.
-        staged: Flag to get staged or non-staged items.
-        offset: offset of retrieved items (i.e. offset=5 will omit the first 6 items).
+        shards: Number of ranges.
         
     Returns:
-        DataFrame of products.
+        List of (lower, upper) bounds (None for open ends), in id order.
         
     '''
+    size = 16**PREFIX_DIGITS
+    if shards < 1 or shards > size:
+        raise Exception('Parameter shards has to be between 1 and {}.'.format(size))
+    prefixes = ['{:0{}x}'.format(k*size//shards, PREFIX_DIGITS) for k in range(1, shards)]
+    lowers = [None] + prefixes
+    uppers = prefixes + [None]
+    return list(zip(lowers, uppers))
+
+
+def where_id(last_id=None, lower=None, upper=None, where=None):
+    '''Query parameter to restrict ids to a range (empty string if unrestricted).
     
-    if staged not in ['true','false']:
-        raise Exception('Parameter staged has to be either true or false.')
-    
-    auth = login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
-                 config.SCOPE, config.HOST)   
-    
-    cols = ['id','sku','categoryIds','img','createdAt']
-    
-    # Language-dependent variables
-    ld_vars = ['name', 'slug', 'description']
-    [cols.append(ld_var + '_' + language) for ld_var in ld_vars for language in languages]
-    # Currency-dependent variables
-    cd_vars = ['price']
-    [cols.append(cd_var + '_' + currency) for cd_var in cd_vars for currency in currencies]
-    
-    df = pd.DataFrame(index=[], columns=cols)
+    Args:
+        last_id: Only ids greater than last_id (keyset pagination).
+        lower: Only ids greater than or equal to lower (ignored if last_id is set).
+        upper: Only ids less than upper.
+        where: Additional query predicate (e.g. 'lastModifiedAt > "..."').
+        
+    Returns:
+        Url-encoded where parameter.
+        
+    '''
+    conditions = []
+    if last_id is not None:
+        conditions.append('id > "{}"'.format(last_id))
+    elif lower is not None:
+        conditions.append('id >= "{}"'.format(lower))
+    if upper is not None:
+        conditions.append('id < "{}"'.format(upper))
+    if where is not None:
+        conditions.append('({})'.format(where))
+    if len(conditions) == 0:
+        return ''
+    return '&where=' + quote(' and '.join(conditions))
+
+
+def _pages(resource, size_chunks=250, params='', name=None, verbose=True,
+           lower=None, upper=None, where=None, last_id=None):
+    '''Yields all result pages of a resource via keyset pagination on the id.
     
-    last_id = None
-    proceed = True
+    Args:
+        resource: API endpoint (product-projections, orders, etc.).
+        size_chunks: Number of items per request.
+        params: Additional query parameters (e.g. '&staged=false').
+        name: Name of the items in progress messages (default: resource).
+        verbose: Flag to print progress in the terminal.
+        lower: Only ids greater than or equal to lower.
+        upper: Only ids less than upper.
+        where: Additional query predicate.
+        last_id: Only ids greater than last_id (e.g. to resume paging).
+        
+    Returns:
+        Generator of lists of items in json.
+        
+    '''
+    name = resource if name is None else name
     progress = 0
 
-    while(proceed):
+    while True:
         
-        if last_id == None:
-            endpoint = 'product-projections?limit={}&sort=id&staged={}'.format(size_chunks, staged)
-        else:
-            endpoint = ('product-projections?limit={}&sort=id&staged={}&where=id%3E%22' + last_id + '%22').format(size_chunks, staged)
+        auth = cached_login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
+                            config.SCOPE, config.HOST)
+        endpoint = '{}?limit={}&sort=id{}'.format(resource, size_chunks, params)
+        endpoint += where_id(last_id, lower, upper, where)
             
         data_json = query(endpoint, config.PROJECT_KEY, auth, config.HOST)
-        df_chunk = pd.DataFrame(index=[], columns=cols)
         results = data_json['results']
+        if len(results) == 0:
+            return
 
-        proceed = len(results)==size_chunks
-        last_id = results[-1]['id']
-
-        progress += size_chunks
+        progress += len(results)
         if verbose:
-            print('Loading products chunk (imported: {}, chunk size = {})'.format(progress, size_chunks))
-        
-        for i, product in enumerate(results):
-            
-            # Mandatory fields
-            df_chunk.loc[i, 'id'] = product['id']
-            df_chunk.loc[i, 'createdAt'] = product['createdAt']
+            print('Loading {} chunk (imported: {}, chunk size = {})'.format(name, progress, size_chunks))
 
-            # Optional fields
-            try:
-                df_chunk.loc[i, 'sku'] = product['masterVariant']['sku']
-            except:
-                df_chunk.loc[i, 'sku'] = ''
-                
-            try:
-                df_chunk.loc[i, 'img'] = product['masterVariant']['images'][0]['url']
-            except:
-                df_chunk.loc[i, 'img'] = ''
-            
-            # Language-dependent variables
-            for ld_var in ld_vars:
-                for language in languages:
-                    var = ld_var + '_' + language
-                    try:
-                        df_chunk.loc[i, var] = product[ld_var][language]
-                    except:
-                        df_chunk.loc[i, var] = ''
-                    
-            # Currency-dependent variables
-            for cd_var in cd_vars:
-                for currency in currencies:
-                    var = cd_var + '_' + currency
-                    df_chunk.loc[i, var] = get_product_price(product['masterVariant']['prices'], currency)
-
-            # Categories
-            cats_json = product['categories']
-            cats_list = []
-            for cat_json in cats_json:
-                cats_list.append(cat_json['id'])
-            df_chunk.loc[i, 'categoryIds'] = cats_list
+        yield results
         
-        # Append chunk to DataFrame     
-        df = df.append(df_chunk, ignore_index=True)
-            
-    return df
+        if len(results) < size_chunks:
+            return
+        last_id = results[-1]['id']
 
 
-def customers(size_chunks=250, verbose=True):
-    '''Queries the commercetools API to create a DataFrame of customers.
+def prefetch(iterable, size=None):
+    '''Iterates in a background thread, keeping up to size items ahead.
     
     Args:
-        nr_items: Maximum number of retrieved items.
-        offset: offset of retrieved items (i.e. offset=5 will omit the first 6 items).
+        iterable: Iterable (e.g. generator of pages).
+        size: Maximum number of items ahead (default: PREFETCH, 0 iterates 
+            in the calling thread).
         
     Returns:
-        DataFrame of customers.
+        Generator of the items (exceptions of the iterable are re-raised).
         
     '''
+    size = PREFETCH if size is None else size
+    if size <= 0:
+        for item in iterable:
+            yield item
+        return
     
-    auth = login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
-                 config.SCOPE, config.HOST)
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
     
-    cols = ['id', 'firstName', 'middleName', 'lastName', 'email', 
-            'dateOfBirth', 'companyName', 
-            'customerGroup_ids', 'customerGroup_names']
-    df = pd.DataFrame(index=[], columns=cols)
+    def put(entry):
+        # Give up if the consumer has stopped (e.g. closed the generator)
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
     
-    last_id = None
-    proceed = True
-    progress = 0
-
-    while(proceed):
-        
-        if last_id == None:
-            endpoint = 'customers?limit={}&sort=id'.format(size_chunks)
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except Exception as e:
+            put((False, e))
         else:
-            endpoint = ('customers?limit={}&sort=id&where=id%3E%22' + last_id + '%22').format(size_chunks)
-            
-        data_json = query(endpoint, config.PROJECT_KEY, auth, config.HOST)
-        df_chunk = pd.DataFrame(index=[], columns=cols)
-        results = data_json['results']
+            put((False, None))
+    
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            more, item = items.get()
+            if not more:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
 
-        proceed = len(results)==size_chunks
-        last_id = results[-1]['id']
 
-        progress += size_chunks
-        if verbose:
-            print('Loading customers chunk (imported: {}, chunk size = {})'.format(progress, size_chunks))
+# Id of the worker process which has been initialized (see _init_worker)
+_worker_pid = None
 
-        for i, customer in enumerate(results):
-            
-            # Mandatory fields
-            df_chunk.loc[i, 'id'] = customer['id']
-            df_chunk.loc[i, 'createdAt'] = customer['createdAt']
 
-            # Optional fields
-            try:
-                df_chunk.loc[i, 'firstName'] = customer['firstName']
-            except:
-                df_chunk.loc[i, 'firstName'] = ''
-                
-            try:
-                df_chunk.loc[i, 'lastName'] = customer['lastName']
-            except:
-                df_chunk.loc[i, 'lastName'] = ''
-                
-            try:
-                df_chunk.loc[i, 'middleName'] = customer['middleName']
-            except:
-                df_chunk.loc[i, 'middleName'] = ''
-                
-            try:
-                df_chunk.loc[i, 'email'] = customer['email']
-            except:
-                df_chunk.loc[i, 'email'] = ''
-                
-            try:
-                df_chunk.loc[i, 'dateOfBirth'] = customer['dateOfBirth']
-            except:
-                df_chunk.loc[i, 'dateOfBirth'] = ''
-                
-            try:
-                df_chunk.loc[i, 'companyName'] = customer['companyName']
-            except:
-                df_chunk.loc[i, 'companyName'] = ''
-                
-            
-            # Customer groups
-            try:
-                groups_json = customer['customerGroup']
-                groups_ids = []
-                groups_names = []
-                for group_json in groups_json:
-                    try:
-                        groups_ids.append(group_json['id'])
-                    except:
-                        None
-                    try:
-                        groups_names.append(group_json['name'])
-                    except:
-                        None
-                df_chunk.loc[i, 'customerGroup_ids'] = groups_ids
-                df_chunk.loc[i, 'customerGroup_names'] = groups_names
-            except:
-                df_chunk.loc[i, 'customerGroup_ids'] = ''
-                df_chunk.loc[i, 'customerGroup_names'] = ''
-            
-        # Append chunk to DataFrame     
-        df = df.append(df_chunk, ignore_index=True)
-            
-    return df
+def _init_worker(processes):
+    # Forked workers must not share connections or the response cache 
+    # database with the parent process, and each one gets its share of the 
+    # rate and concurrency limits (once per worker process)
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    _worker_pid = os.getpid()
+    api.close_sessions()
+    api.share_limits(processes)
+    if api.CACHE is not None:
+        api.CACHE = api.CACHE.reopen()
+
+
+def _fetch_worker(processes, *args):
+    # Runs in a worker process: fetches a shard and returns the buffer with 
+    # the request statistics of the shard (for api.add_stats())
+    _init_worker(processes)
+    api.reset_stats()
+    buf = _fetch_shard(*args)
+    return buf, api.get_stats()
 
+
+def _fetch_shard(resource, buf, add, size_chunks, params, name, verbose,
+                 lower, upper, where, log=None):
+    # Runs in a thread, or in a worker process (then the arguments and the 
+    # returned buffer are pickled)
+    if log is None:
+        for results in prefetch(_pages(resource, size_chunks, params, name, 
+                                       verbose, lower, upper, where)):
+            add(buf, results)
+        return buf
     
-def orders(size_chunks=250, languages=['en','de'], verbose=True):
-    '''Queries the commercetools API to create a DataFrame of orders.
+    # Restore the pages of a previous run and continue after the last one
+    last_id = None
+    for last_id, page in log.load():
+        buf.extend(page)
+    if log.finished:
+        return buf
+    try:
+        for results in prefetch(_pages(resource, size_chunks, params, name, 
+                                       verbose, lower, upper, where, last_id)):
+            page = add(buf.new(), results)
+            log.append(results[-1]['id'], page)
+            buf.extend(page)
+        log.finish()
+    finally:
+        log.close()
+    return buf
+
+
+def _fetch(resource, buf, add, size_chunks=250, params='', name=None,
+           verbose=True, shards=1, max_workers=None, where=None,
+           processes=None, checkpoint=None, resume=False):
+    '''Fetches all items of a resource into a column buffer.
     
     Args:
-        nr_items: Maximum number of retrieved items.
-        offset: offset of retrieved items (i.e. offset=5 will omit the first 6 items).
+        resource: API endpoint (product-projections, orders, etc.).
+        buf: Empty ColumnBuffer.
+        add: Function to append a page of items to a buffer, add(buf, results).
+        size_chunks: Number of items per request.
+        params: Additional query parameters (e.g. '&staged=false').
+        name: Name of the items in progress messages (default: resource).
+        verbose: Flag to print progress in the terminal.
+        shards: Number of id ranges to page concurrently.
+        max_workers: Maximum number of concurrent requests (default: number 
+            of shards, at most api.POOL_SIZE).
+        where: Additional query predicate.
+        processes: Number of worker processes which fetch and convert the 
+            shards (at least as many shards are used). add has to be 
+            picklable (e.g. a functools.partial of a records function). Each 
+            worker gets 1/processes of the rate and concurrency limits of 
+            the api module, and its requests are added to api.get_stats().
+        checkpoint: Directory to log the progress of the export in (True: 
+            CHECKPOINT_DIR/<name>, default: no checkpoint). The checkpoint 
+            is removed when the export is complete.
+        resume: Flag to continue from the checkpoint of an interrupted run 
+            with the same parameters (implies checkpoint=True).
         
     Returns:
-        DataFrame of orders.
+        The column buffer.
         
     '''
+    name = resource if name is None else name
     
-    auth = login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
-                 config.SCOPE, config.HOST)
-
-    cols = ['productId','customerId','customerEmail','anonymousId','orderId',
-            'createdAt','productPrice','totalPrice','currency','quantity',
-            'country']
-            
-    # Language-dependent variables
-    ld_vars = ['name']
-    [cols.append(ld_var + '_' + language) for ld_var in ld_vars for language in languages]
+    if processes is not None and processes > 1:
+        shards = max(shards, processes)
     
-    df = pd.DataFrame([], columns=cols)
+    if checkpoint is None and resume:
+        checkpoint = True
+    if checkpoint is True:
+        checkpoint = os.path.join(CHECKPOINT_DIR, name)
+    if checkpoint:
+        signature = {'resource': resource, 'size_chunks': size_chunks, 
+                     'params': params, 'where': where, 'shards': shards, 
+                     'cols': buf.cols, 
+                     'options': getattr(add, 'keywords', None)}
+        checkpoint = Checkpoint(checkpoint, signature, resume)
+        logs = [checkpoint.shard(nr_shard) for nr_shard in range(max(shards, 1))]
+    else:
+        checkpoint = None
+        logs = [None]*max(shards, 1)
     
-    last_id = None
-    proceed = True
-    progress = 0
+    worker = processes is not None and processes > 1
+    if worker:
+        executor = ProcessPoolExecutor(max_workers=processes)
+    elif shards <= 1:
+        _fetch_shard(resource, buf, add, size_chunks, params, name, verbose, 
+                     None, None, where, logs[0])
+        if checkpoint is not None:
+            checkpoint.clear()
+        return buf
+    else:
+        if max_workers is None:
+            max_workers = min(shards, api.POOL_SIZE)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    
+    with executor:
+        futures = []
+        for nr_shard, (lower, upper) in enumerate(shard_bounds(shards)):
+            name_shard = '{} (shard {} of {})'.format(name, nr_shard+1, shards)
+            args = (resource, buf.new(), add, size_chunks, params, name_shard,
+                    verbose, lower, upper, where, logs[nr_shard])
+            if worker:
+                futures.append(executor.submit(_fetch_worker, processes, *args))
+            else:
+                futures.append(executor.submit(_fetch_shard, *args))
+        # Shards are in id order, so merging them in order keeps the id order
+        for future in futures:
+            if worker:
+                shard, stats = future.result()
+                api.add_stats(stats)
+            else:
+                shard = future.result()
+            buf.extend(shard)
+    if checkpoint is not None:
+        checkpoint.clear()
+    return buf
 
-    while(proceed):
+
+def products(staged='false', size_chunks=250, 
+             languages=['en','de'], currencies=['USD','EUR'],
+             verbose=True, shards=1, max_workers=None,
+             where=None, expand=False, processes=None, typed=False,
+             checkpoint=None, resume=False, country='', channel='',
+             customer_group='', date=''):
+    '''Queries the commercetools API to create a DataFrame of products.
+    
+    Args:
+        staged: Flag to get staged or non-staged items.
+        size_chunks: Number of items per request.
+        languages: Languages of language-dependent variables.
+        currencies: Currencies of prices.
+        verbose: Flag to print progress in the terminal.
+        shards: Number of id ranges to page concurrently (default: 1).
+        max_workers: Maximum number of concurrent requests.
+        where: Query predicate to restrict the items (e.g. 
+            'lastModifiedAt > "2017-01-01T00:00:00.000Z"').
+        expand: Flag to expand the categories and their ancestors in the 
+            same requests and add columns with category names and paths 
+            (see records.products_buffer).
+        processes: Number of worker processes which fetch and convert 
+            shards (default: fetch them in threads of this process).
+        typed: Flag to return a schema.TypedFrame instead (int64 cents, 
+            categoricals, datetime64, flat multi-valued columns).
+        checkpoint: Flag (or directory) to log the progress, so an 
+            interrupted export can be resumed (see checkpoint.py).
+        resume: Flag to continue from the checkpoint of an interrupted run.
+        country: Country of prices (default: any country).
+        channel: Channel id of prices (default: any channel).
+        customer_group: Customer group id of prices (default: any group).
+        date: ISO 8601 date at which prices are valid (default: any date).
         
-        if last_id == None:
-            endpoint = 'orders?limit={}&sort=id'.format(size_chunks)
-        else:
-            endpoint = ('orders?limit={}&sort=id&where=id%3E%22' + last_id + '%22').format(size_chunks)
+    Returns:
+        DataFrame of products.
+        
+    '''
+    
+    params = _products_params(staged, expand)
+    buf = records.products_buffer(languages, currencies, expand)
+    add = functools.partial(records.add_products, languages=languages,
+                            currencies=currencies, expand=expand,
+                            country=country, channel=channel,
+                            customer_group=customer_group, date=date)
+    _fetch('product-projections', buf, add, size_chunks, params,
+           'products', verbose, shards, max_workers, where, processes,
+           checkpoint, resume)
             
-        data_json = query(endpoint, config.PROJECT_KEY, auth, config.HOST)
-        df_chunk = pd.DataFrame(index=[], columns=cols)
-        results = data_json['results']
+    return buf.to_typed() if typed else buf.to_df()
 
-        proceed = len(results)==size_chunks
-        last_id = results[-1]['id']
 
-        progress += size_chunks
-        if verbose:
-            print('Loading orders chunk (imported: {}, chunk size = {})'.format(progress, size_chunks))
+def _products_params(staged, expand):
+    if staged not in ['true','false']:
+        raise Exception('Parameter staged has to be either true or false.')
+    params = '&staged=' + staged
+    if expand:
+        params += EXPAND_CATEGORIES
+    return params
+
+
+def customers(size_chunks=250, verbose=True, shards=1, max_workers=None,
+              where=None, processes=None, typed=False, checkpoint=None,
+              resume=False):
+    '''Queries the commercetools API to create a DataFrame of customers.
+    
+    Args:
+        size_chunks: Number of items per request.
+        verbose: Flag to print progress in the terminal.
+        shards: Number of id ranges to page concurrently (default: 1).
+        max_workers: Maximum number of concurrent requests.
+        where: Query predicate to restrict the items (e.g. 
+            'lastModifiedAt > "2017-01-01T00:00:00.000Z"').
+        processes: Number of worker processes which fetch and convert 
+            shards (default: fetch them in threads of this process).
+        typed: Flag to return a schema.TypedFrame instead (int64 cents, 
+            categoricals, datetime64, flat multi-valued columns).
+        checkpoint: Flag (or directory) to log the progress, so an 
+            interrupted export can be resumed (see checkpoint.py).
+        resume: Flag to continue from the checkpoint of an interrupted run.
         
-        counter = 0
+    Returns:
+        DataFrame of customers.
         
-        for i, order in enumerate(results):
-            
-            nr_items = len(order['lineItems'])
+    '''
+    
+    buf = records.customers_buffer()
+    _fetch('customers', buf, records.add_customers, size_chunks, 
+           verbose=verbose, shards=shards, max_workers=max_workers, where=where,
+           processes=processes, checkpoint=checkpoint, resume=resume)
             
-            for j in range(nr_items):
-                    
-                # Mandatory fields
-                df_chunk.loc[counter, 'orderId'] = order['id']
-                df_chunk.loc[counter, 'productId'] = order['lineItems'][j]['productId']
-                df_chunk.loc[counter, 'createdAt'] = order['createdAt']
-                df_chunk.loc[counter, 'totalPrice'] = order['totalPrice']['centAmount']
-                df_chunk.loc[counter, 'currency'] = order['totalPrice']['currencyCode']
-
-                # Optional fields
-                try:
-                    df_chunk.loc[counter, 'customerId'] = order['customerId']
-                except KeyError:
-                    df_chunk.loc[counter, 'customerId'] = 'anonymous'
-                    
-                try:
-                    df_chunk.loc[counter, 'customerEmail'] = order['customerEmail']
-                except KeyError:
-                    df_chunk.loc[counter, 'customerEmail'] = ''
-                    
-                try:
-                    df_chunk.loc[counter, 'anonymousId'] = order['anonymousId']
-                except KeyError:
-                    df_chunk.loc[counter, 'anonymousId'] = ''
-                    
-                try:
-                    df_chunk.loc[counter, 'country'] = order['country']
-                except KeyError:
-                    df_chunk.loc[counter, 'country'] = ''
-                    
-                try:
-                    df_chunk.loc[counter, 'productPrice'] = order['lineItems'][j]['price']['value']['centAmount']
-                except:
-                    df_chunk.loc[counter, 'productPrice'] = ''
-                    
-                try:
-                    df_chunk.loc[counter, 'currency'] = order['lineItems'][j]['price']['value']['currencyCode']
-                except:
-                    df_chunk.loc[counter, 'currency'] = ''
-                    
-                try:
-                    df_chunk.loc[counter, 'quantity'] = order['lineItems'][j]['quantity']
-                except:
-                    df_chunk.loc[counter, 'quantity'] = ''
-                    
-                # Language-dependent variables
-                for ld_var in ld_vars:
-                    for language in languages:
-                        var = ld_var + '_' + language
-                        try:
-                            df_chunk.loc[i, var] = order['lineItems'][j][ld_var][language]
-                        except:
-                            df_chunk.loc[i, var] = ''
-                
-                counter += 1
-
-        # Append chunk to DataFrame     
-        df = df.append(df_chunk, ignore_index=True)
+    return buf.to_typed() if typed else buf.to_df()
+
+    
+def orders(size_chunks=250, languages=['en','de'], verbose=True, shards=1,
+           max_workers=None, where=None, processes=None, typed=False,
+           checkpoint=None, resume=False):
+    '''Queries the commercetools API to create a DataFrame of orders.
+    
+    Args:
+        size_chunks: Number of items per request.
+        languages: Languages of language-dependent variables.
+        verbose: Flag to print progress in the terminal.
+        shards: Number of id ranges to page concurrently (default: 1).
+        max_workers: Maximum number of concurrent requests.
+        where: Query predicate to restrict the items (e.g. 
+            'lastModifiedAt > "2017-01-01T00:00:00.000Z"').
+        processes: Number of worker processes which fetch and convert 
+            shards (default: fetch them in threads of this process).
+        typed: Flag to return a schema.TypedFrame instead (int64 cents, 
+            categoricals, datetime64, flat multi-valued columns).
+        checkpoint: Flag (or directory) to log the progress, so an 
+            interrupted export can be resumed (see checkpoint.py).
+        resume: Flag to continue from the checkpoint of an interrupted run.
+        
+    Returns:
+        DataFrame of orders (one row per line item).
+        
+    '''
+    
+    buf = records.orders_buffer(languages)
+    add = functools.partial(records.add_orders, languages=languages)
+    _fetch('orders', buf, add, size_chunks, verbose=verbose, shards=shards,
+           max_workers=max_workers, where=where, processes=processes,
+           checkpoint=checkpoint, resume=resume)
             
-    return df
+    return buf.to_typed() if typed else buf.to_df()
             
 
-def categories(size_chunks=250, languages=['en','de'], verbose=True):
+def categories(size_chunks=250, languages=['en','de'], verbose=True, shards=1,
+               max_workers=None, where=None, processes=None, typed=False,
+               checkpoint=None, resume=False):
     '''Queries the commercetools API to create a DataFrame of categories.
     
     Args:
-        nr_items: Maximum number of retrieved items.
+        size_chunks: Number of items per request.
+        languages: Languages of language-dependent variables.
+        verbose: Flag to print progress in the terminal.
+        shards: Number of id ranges to page concurrently (default: 1).
+        max_workers: Maximum number of concurrent requests.
+        where: Query predicate to restrict the items (e.g. 
+            'lastModifiedAt > "2017-01-01T00:00:00.000Z"').
+        processes: Number of worker processes which fetch and convert 
+            shards (default: fetch them in threads of this process).
+        typed: Flag to return a schema.TypedFrame instead (int64 cents, 
+            categoricals, datetime64, flat multi-valued columns).
+        checkpoint: Flag (or directory) to log the progress, so an 
+            interrupted export can be resumed (see checkpoint.py).
+        resume: Flag to continue from the checkpoint of an interrupted run.
         
     Returns:
         DataFrame of categories.
         
     '''
     
-    auth = login(config.CLIENT_ID, config.CLIENT_SECRET, config.PROJECT_KEY, 
-                 config.SCOPE, config.HOST)
+    buf = records.categories_buffer(languages)
+    add = functools.partial(records.add_categories, languages=languages)
+    _fetch('categories', buf, add, size_chunks, verbose=verbose, shards=shards,
+           max_workers=max_workers, where=where, processes=processes,
+           checkpoint=checkpoint, resume=resume)
+            
+    return buf.to_typed() if typed else buf.to_df()
+
+
+def _stream(resource, buf, add, size_chunks=250, params='', name=None,
+            verbose=True, where=None, output='df'):
+    '''Yields all items of a resource page by page.
     
-    cols = ['id','createdAt']
+    Args:
+        resource: API endpoint (product-projections, orders, etc.).
+        buf: Empty ColumnBuffer (a new one is used for each page).
+        add: Function to append a page of items to a buffer, add(buf, results).
+        size_chunks: Number of items per request.
+        params: Additional query parameters (e.g. '&staged=false').
+        name: Name of the items in progress messages (default: resource).
+        verbose: Flag to print progress in the terminal.
+        where: Additional query predicate.
+        output: Format of the pages, 'df' (DataFrame) or 'records' (list 
+            of dictionaries).
+        
+    Returns:
+        Generator of pages.
+        
+    '''
+    if output not in ['df','records']:
+        raise Exception('Parameter output has to be either df or records.')
+    for results in prefetch(_pages(resource, size_chunks, params, name, verbose,
+                                   where=where)):
+        buf_page = buf.new()
+        add(buf_page, results)
+        yield buf_page.to_df() if output == 'df' else buf_page.records()
+
 
-    # Language-dependent variables
-    ld_vars = ['name','slug','description']
-    [cols.append(ld_var + '_' + language) for ld_var in ld_vars for language in languages]
+def stream_products(staged='false', size_chunks=250, 
+                    languages=['en','de'], currencies=['USD','EUR'],
+                    verbose=True, where=None, expand=False, output='df',
+                    country='', channel='', customer_group='', date=''):
+    '''Yields products page by page (see products()).
     
-    df = pd.DataFrame(index=[], columns=cols)
+    Args:
+        output: Format of the pages, 'df' (DataFrame) or 'records' (list 
+            of dictionaries).
+        
+    Returns:
+        Generator of pages of products.
+        
+    '''
+    params = _products_params(staged, expand)
+    buf = records.products_buffer(languages, currencies, expand)
+    add = functools.partial(records.add_products, languages=languages,
+                            currencies=currencies, expand=expand,
+                            country=country, channel=channel,
+                            customer_group=customer_group, date=date)
+    return _stream('product-projections', buf, add, size_chunks, params,
+                   'products', verbose, where, output)
+
+
+def stream_customers(size_chunks=250, verbose=True, where=None, output='df'):
+    '''Yields customers page by page (see customers()).
     
-    last_id = None
-    proceed = True
-    progress = 0
+    Args:
+        output: Format of the pages, 'df' (DataFrame) or 'records' (list 
+            of dictionaries).
+        
+    Returns:
+        Generator of pages of customers.
+        
+    '''
+    return _stream('customers', records.customers_buffer(), records.add_customers,
+                   size_chunks, verbose=verbose, where=where, output=output)
+
 
-    while(proceed):
+def stream_orders(size_chunks=250, languages=['en','de'], verbose=True,
+                  where=None, output='df'):
+    '''Yields orders page by page (see orders()).
+    
+    All line items of an order are in the same page.
+    
+    Args:
+        output: Format of the pages, 'df' (DataFrame) or 'records' (list 
+            of dictionaries).
         
-        if last_id == None:
-            endpoint = 'categories?limit={}&sort=id'.format(size_chunks)
-        else:
-            endpoint = ('categories?limit={}&sort=id&where=id%3E%22' + last_id + '%22').format(size_chunks)
-            
-        data_json = query(endpoint, config.PROJECT_KEY, auth, config.HOST)
-        df_chunk = pd.DataFrame(index=[], columns=cols)
-        results = data_json['results']
+    Returns:
+        Generator of pages of orders (one row per line item).
+        
+    '''
+    add = functools.partial(records.add_orders, languages=languages)
+    return _stream('orders', records.orders_buffer(languages), add, size_chunks,
+                   verbose=verbose, where=where, output=output)
 
-        proceed = len(results)==size_chunks
-        last_id = results[-1]['id']
 
-        progress += size_chunks
-        if verbose:
-            print('Loading categories chunk (imported: {}, chunk size = {})'.format(progress, size_chunks))
+def stream_categories(size_chunks=250, languages=['en','de'], verbose=True,
+                      where=None, output='df'):
+    '''Yields categories page by page (see categories()).
+    
+    Args:
+        output: Format of the pages, 'df' (DataFrame) or 'records' (list 
+            of dictionaries).
         
-        for i, category in enumerate(results):
-            
-            # Mandatory fields
-            df_chunk.loc[i, 'id'] = category['id']
-            df_chunk.loc[i, 'createdAt'] = category['createdAt']
-                    
-            # Language-dependent variables
-            for ld_var in ld_vars:
-                for language in languages:
-                    var = ld_var + '_' + language
-                    try:
-                        df_chunk.loc[i, var] = category[ld_var][language]
-                    except:
-                        df_chunk.loc[i, var] = ''
-                
-        # Append chunk to DataFrame     
-        df = df.append(df_chunk, ignore_index=True)
-            
-    return df
-            
+    Returns:
+        Generator of pages of categories.
+        
+    '''
+    add = functools.partial(records.add_categories, languages=languages)
+    return _stream('categories', records.categories_buffer(languages), add,
+                   size_chunks, verbose=verbose, where=where, output=output)
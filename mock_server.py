@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Local stand-in for the commercetools API, serving a synthetic dataset (see
+datagen.py) for offline tests and reproducible benchmarks.
+
+Endpoints:
+
+    - POST /oauth/token
+    - GET /<project_key>/product-projections, orders, customers, categories
+      (limit/offset, sort=id, where with id/lastModifiedAt comparisons,
+      expand of references, e.g. categories[*].ancestors[*]; responses
+      carry an ETag, If-None-Match is answered with 304)
+    - GET /<project_key>/products/<id>, categories/<id> (also orders/<id>,
+      customers/<id>, product-projections/<id>)
+
+Latency and throttling (429/503 responses with Retry-After) can be injected.
+
+Usage:
+
+    server = MockServer(Dataset(nr_products=10000)).start()
+    server.register('LOCAL')     # config.HOST = 'LOCAL'
+    ...
+    server.stop()
+
+or from the command line: python mock_server.py --products 10000 --port 8080
+
+@author: amagrabi
+
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+import api
+from datagen import Dataset
+
+
+RESOURCES = {'product-projections': 'products', 'products': 'products',
+             'orders': 'orders', 'customers': 'customers',
+             'categories': 'categories'}
+
+# Resources of the typeId of references (for reference expansion)
+TYPE_IDS = {'product': 'products', 'category': 'categories',
+            'customer': 'customers', 'order': 'orders'}
+
+MAX_LIMIT = 500
+
+CONDITION = re.compile(r'^(\w+)\s*(>=|<=|!=|>|<|=)\s*(?:"([^"]*)"|(-?\d+))$')
+CONDITION_IN = re.compile(r'^(\w+)\s+in\s*\((.*)\)$')
+
+
+class QueryError(Exception):
+    pass
+
+
+def parse_where(where):
+    '''Parses a query predicate into a list of (field, operator, value).
+
+    Supports conditions on top-level fields joined by 'and', e.g.
+    'id > "abc" and (lastModifiedAt >= "2017-01-01T00:00:00.000Z")' and
+    'id in ("a", "b")' (operator 'in', value is a list).
+
+    '''
+    conditions = []
+    for part in re.split(r'\s+and\s+', where.strip()):
+        part = part.strip()
+        while part.startswith('(') and part.endswith(')') and not CONDITION_IN.match(part):
+            part = part[1:-1].strip()
+        match = CONDITION_IN.match(part)
+        if match:
+            values = re.findall(r'"([^"]*)"', match.group(2))
+            conditions.append((match.group(1), 'in', values))
+            continue
+        match = CONDITION.match(part)
+        if match is None:
+            raise QueryError('Malformed parameter: where: {}'.format(part))
+        field, op, text, number = match.groups()
+        conditions.append((field, op, text if text is not None else int(number)))
+    return conditions
+
+
+OPERATORS = {'>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+             '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+             '=': lambda a, b: a == b, '!=': lambda a, b: a != b,
+             'in': lambda a, b: a in b}
+
+
+class MockServer(object):
+    '''Mock commercetools API serving a dataset on a local port.
+
+    Args:
+        dataset: datagen.Dataset.
+        host: Interface to listen on.
+        port: Port (0 for a free port).
+        project_key: Project key in the urls.
+        latency: Delay of each response in seconds.
+        jitter: Maximum additional random delay in seconds.
+        error_rate: Share of API requests answered with error_status.
+        error_status: Status of injected errors (429 or 503).
+        retry_after: Retry-After header of injected errors in seconds.
+        expires_in: Lifetime of access tokens in seconds.
+        seed: Random seed for jitter and injected errors.
+
+    '''
+
+    def __init__(self, dataset, host='127.0.0.1', port=0, project_key='mock-project',
+                 latency=0.0, jitter=0.0, error_rate=0.0, error_status=429,
+                 retry_after=1, expires_in=172800, seed=0):
+        self.dataset = dataset
+        self.project_key = project_key
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.expires_in = expires_in
+        self.tokens = set()
+        self.stats = {'requests': 0, 'tokens': 0, 'errors': 0, 'bytes': 0,
+                      'not_modified': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        server = self
+
+        class Handler(RequestHandler):
+            mock = server
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        '''Serves requests in a background thread.
+
+        '''
+        self._thread = threading.Thread(target=self.httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def register(self, host='LOCAL'):
+        '''Registers the server as host for api.login() and api.query().
+
+        '''
+        api.register_host(host, self.url, self.url)
+        return host
+
+    def count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def delay(self):
+        if self.latency > 0 or self.jitter > 0:
+            with self._lock:
+                jitter = self._random.uniform(0, self.jitter)
+            time.sleep(self.latency + jitter)
+
+    def throttle(self):
+        '''Whether to answer the current request with an injected error.
+
+        '''
+        if self.error_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def issue_token(self):
+        with self._lock:
+            token = 'mock-token-{}'.format(len(self.tokens))
+            self.tokens.add(token)
+        return token
+
+    # Queries
+
+    def get(self, resource, item_id):
+        '''Single item by id (None if unknown).
+
+        '''
+        entity = RESOURCES[resource]
+        i = self.dataset.index(entity, item_id)
+        if i is None:
+            return None
+        if resource == 'products':
+            return self.dataset.product(i)
+        return self.dataset.item(entity, i)
+
+    def expand(self, node, path):
+        '''Inlines referenced items (as 'obj') along an expansion path.
+
+        Args:
+            node: Item in json (changed in place).
+            path: Expansion path, e.g. 'categories[*].ancestors[*]'.
+
+        '''
+        field, _, rest = path.partition('.')
+        many = field.endswith('[*]')
+        field = field[:-3] if many else field
+        if not isinstance(node, dict) or field not in node:
+            return
+        for value in (node[field] if many else [node[field]]):
+            if isinstance(value, dict) and 'typeId' in value and 'id' in value:
+                entity = TYPE_IDS.get(value['typeId'])
+                if 'obj' not in value and entity is not None:
+                    i = self.dataset.index(entity, value['id'])
+                    if i is not None:
+                        value['obj'] = self.dataset.item(entity, i)
+                value = value.get('obj')
+            if rest:
+                self.expand(value, rest)
+
+    def search(self, resource, params):
+        '''Paged query of a resource.
+
+        Args:
+            resource: Resource (product-projections, orders, etc.).
+            params: Dictionary of query parameters (lists of values).
+
+        Returns:
+            Page of results in json (PagedQueryResult).
+
+        '''
+        entity = RESOURCES[resource]
+        dataset = self.dataset
+        try:
+            limit = int(params.get('limit', ['20'])[0])
+            offset = int(params.get('offset', ['0'])[0])
+        except ValueError:
+            raise QueryError('Malformed parameter: limit/offset')
+        if limit < 0 or limit > MAX_LIMIT or offset < 0:
+            raise QueryError('Parameter limit has to be between 0 and {}'.format(MAX_LIMIT))
+
+        descending = False
+        for sort in params.get('sort', []):
+            field, _, direction = sort.strip().partition(' ')
+            if field != 'id' or direction.strip() not in ('', 'asc', 'desc'):
+                raise QueryError('Sorting is only supported by id.')
+            descending = direction.strip() == 'desc'
+
+        conditions = []
+        for where in params.get('where', []):
+            conditions += parse_where(where)
+
+        # Id conditions select a slice of the id order, the other conditions
+        # are checked per item
+        lower, upper, inclusive, ids, others = None, None, True, None, []
+        for field, op, value in conditions:
+            if field == 'id' and op in ('>', '>='):
+                if lower is None or value > lower or (value == lower and op == '>'):
+                    lower, inclusive = value, op == '>='
+            elif field == 'id' and op == '<':
+                upper = value if upper is None else min(upper, value)
+            elif field == 'id' and op in ('=', 'in'):
+                values = [value] if op == '=' else value
+                ids = set(values) if ids is None else ids & set(values)
+            else:
+                others.append((field, op, value))
+
+        if ids is not None:
+            positions = sorted((i for i in (dataset.index(entity, item_id) for item_id in ids)
+                                if i is not None), key=dataset.ids[entity].__getitem__)
+            positions = [i for i in positions if
+                         (lower is None or OPERATORS['>=' if inclusive else '>'](dataset.ids[entity][i], lower)) and
+                         (upper is None or dataset.ids[entity][i] < upper)]
+        else:
+            start, stop = dataset.bounds(entity, lower, upper, inclusive)
+            positions = dataset.order[entity][start:stop]
+        deleted = dataset.deleted[entity]
+        if descending:
+            positions = positions[::-1]
+
+        def matches(i):
+            if i in deleted:
+                return False
+            item = None
+            for field, op, value in others:
+                if field == 'lastModifiedAt':
+                    actual = dataset.last_modified(entity, i)
+                else:
+                    item = dataset.item(entity, i) if item is None else item
+                    if field not in item:
+                        return False
+                    actual = item[field]
+                if not OPERATORS[op](actual, value):
+                    return False
+            return True
+
+        if len(others) == 0 and len(deleted) == 0:
+            results = [self.get(resource, dataset.ids[entity][i])
+                       for i in positions[offset:offset + limit]]
+            return {'limit': limit, 'offset': offset, 'count': len(results),
+                    'total': len(positions), 'results': results}
+
+        results = []
+        total = 0
+        for i in positions:
+            if not matches(i):
+                continue
+            if offset <= total < offset + limit:
+                results.append(self.get(resource, dataset.ids[entity][i]))
+            total += 1
+        return {'limit': limit, 'offset': offset, 'count': len(results),
+                'total': total, 'results': results}
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    mock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data, headers={}):
+        self.send_body(status, json.dumps(data).encode('utf-8'), headers)
+
+    def send_body(self, status, body, headers={}):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.mock.count('bytes', len(body))
+
+    def send_error_json(self, status, code, message, headers={}):
+        self.mock.count('errors')
+        self.send_json(status, {'statusCode': status, 'message': message,
+                                'errors': [{'code': code, 'message': message}]},
+                       headers)
+
+    def do_POST(self):
+        mock = self.mock
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        mock.delay()
+        if urlsplit(self.path).path.rstrip('/') != '/oauth/token':
+            return self.send_error_json(404, 'ResourceNotFound', 'Unknown endpoint.')
+        if not self.headers.get('Authorization', '').startswith('Basic '):
+            return self.send_error_json(401, 'invalid_client', 'Missing client credentials.')
+        mock.count('tokens')
+        self.send_json(200, {'access_token': mock.issue_token(),
+                             'token_type': 'Bearer',
+                             'expires_in': mock.expires_in,
+                             'scope': 'manage_project:{}'.format(mock.project_key)})
+
+    def do_GET(self):
+        mock = self.mock
+        mock.count('requests')
+        mock.delay()
+
+        token = self.headers.get('Authorization', '')[len('Bearer '):]
+        if token not in mock.tokens:
+            return self.send_error_json(401, 'invalid_token', 'The access token is invalid.')
+        if mock.throttle():
+            message = 'Too many requests.' if mock.error_status == 429 else 'Service unavailable.'
+            return self.send_error_json(mock.error_status, 'Throttled', message,
+                                        {'Retry-After': str(mock.retry_after)})
+
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+        if len(parts) < 2 or parts[0] != mock.project_key or parts[1] not in RESOURCES:
+            return self.send_error_json(404, 'ResourceNotFound', 'Unknown endpoint.')
+        try:
+            if len(parts) == 2:
+                data = mock.search(parts[1], params)
+                items = data['results']
+            elif len(parts) == 3:
+                data = mock.get(parts[1], parts[2])
+                if data is None:
+                    return self.send_error_json(404, 'ResourceNotFound',
+                                                "The Resource with ID '{}' was not found.".format(parts[2]))
+                items = [data]
+            else:
+                return self.send_error_json(404, 'ResourceNotFound', 'Unknown endpoint.')
+        except QueryError as e:
+            return self.send_error_json(400, 'InvalidInput', str(e))
+        for path in params.get('expand', []):
+            for item in items:
+                mock.expand(item, path)
+        body = json.dumps(data).encode('utf-8')
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            mock.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_body(200, body, {'ETag': etag})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock commercetools API')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--customers', type=int, default=None)
+    parser.add_argument('--categories', type=int, default=None)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=429)
+    args = parser.parse_args()
+
+    dataset = Dataset(args.products, args.orders, args.customers,
+                      args.categories, args.depth, args.seed)
+    server = MockServer(dataset, port=args.port, latency=args.latency,
+                        jitter=args.jitter, error_rate=args.error_rate,
+                        error_status=args.error_status, seed=args.seed)
+    print('Serving mock API at {} (project key: {})'.format(server.url, server.project_key))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Vectorized price resolution for pages of products.
+
+The prices of all products are flattened into arrays once (PriceTable), and
+the applicable price of every product is then selected for a target
+(currency, country, channel, customer group, date) with array operations
+instead of scanning each price list per product and currency.
+
+Selection follows api_util.get_product_price: the first price in the list
+of a product which matches the target wins. Unset criteria of the target
+match any price, set criteria only match prices with equal values, and a
+date only matches prices valid at that date (validFrom <= date < validUntil).
+
+@author: amagrabi
+
+"""
+
+import numpy as np
+
+
+# Exceptions raised when an optional field is missing in the json data
+MISSING = (KeyError, IndexError, TypeError)
+
+
+class PriceTable(object):
+    '''Flattened prices of a list of products (or variants).
+
+    Args:
+        price_lists: List of price lists in json, one per product.
+
+    '''
+
+    def __init__(self, price_lists):
+        self.nr_products = len(price_lists)
+        try:
+            amounts, currencies = _values(price_lists)
+        except MISSING:
+            # Prices without value are skipped (slow path)
+            price_lists = [[price for price in prices or [] if _has_value(price)]
+                           for prices in price_lists]
+            amounts, currencies = _values(price_lists)
+        self._price_lists = price_lists
+        self.rows = np.repeat(np.arange(self.nr_products, dtype=np.int64),
+                              [len(prices) for prices in price_lists])
+        self.amounts = np.array(amounts, dtype=float)
+        self.currencies = np.array(currencies, dtype=object)
+        # Fields which are rarely used are only flattened on demand
+        self._fields = {}
+
+    def _field(self, name):
+        '''Object array of a field of all prices (empty strings if missing).
+
+        '''
+        if name not in self._fields:
+            get = _ref_id if name in ('channel', 'customerGroup') else _get
+            self._fields[name] = np.array([get(price, name) for prices in self._price_lists
+                                           for price in prices], dtype=object)
+        return self._fields[name]
+
+    @classmethod
+    def from_products(cls, products, variant='masterVariant'):
+        '''PriceTable of the prices of a variant of products (product projections).
+
+        '''
+        try:
+            price_lists = [product[variant]['prices'] for product in products]
+        except MISSING:
+            price_lists = [_prices(product, variant) for product in products]
+        return cls(price_lists)
+
+    def __len__(self):
+        return self.nr_products
+
+    def matches(self, currency, country='', channel='', customer_group='',
+                date=''):
+        '''Boolean array of the prices which match a target.
+
+        Args:
+            currency: Currency code.
+            country: Country code (empty string: any country).
+            channel: Channel id (empty string: any channel).
+            customer_group: Customer group id (empty string: any group).
+            date: ISO 8601 date, e.g. '2017-06-01T00:00:00.000Z' (empty
+                string: any date).
+
+        '''
+        mask = self.currencies == currency
+        if country != '':
+            mask &= self._field('country') == country
+        if channel != '':
+            mask &= self._field('channel') == channel
+        if customer_group != '':
+            mask &= self._field('customerGroup') == customer_group
+        if date != '':
+            # Dates in the same ISO 8601 format compare like strings
+            valid_until = self._field('validUntil')
+            mask &= self._field('validFrom') <= date
+            mask &= (valid_until == '') | (valid_until > date)
+        return mask
+
+    def resolve(self, currency, country='', channel='', customer_group='',
+                date=''):
+        '''Applicable cent amount per product (NaN if there is none).
+
+        Args:
+            See matches().
+
+        Returns:
+            Float array with one price per product.
+
+        '''
+        mask = self.matches(currency, country, channel, customer_group, date)
+        # Prices are in product order, so the first occurrence of each
+        # product among the matching prices is its first matching price
+        rows = self.rows[mask]
+        first = np.ones(len(rows), dtype=bool)
+        np.not_equal(rows[1:], rows[:-1], out=first[1:])
+        prices = np.full(self.nr_products, np.nan)
+        prices[rows[first]] = self.amounts[mask][first]
+        return prices
+
+    def columns(self, currencies, country='', channel='', customer_group='',
+                date='', prefix='price_'):
+        '''Price columns for several currencies.
+
+        Returns:
+            Dictionary of float arrays by column name (prefix + currency).
+
+        '''
+        return {prefix + currency: self.resolve(currency, country, channel,
+                                                customer_group, date)
+                for currency in currencies}
+
+
+def _values(price_lists):
+    values = [price['value'] for prices in price_lists for price in prices]
+    return ([value['centAmount'] for value in values],
+            [value['currencyCode'] for value in values])
+
+
+def _has_value(price):
+    try:
+        price['value']['centAmount']
+        price['value']['currencyCode']
+        return True
+    except MISSING:
+        return False
+
+
+def _prices(product, variant):
+    try:
+        return product[variant]['prices']
+    except MISSING:
+        return []
+
+
+def _get(price, field):
+    return price.get(field, '')
+
+
+def _ref_id(price, field):
+    try:
+        return price[field]['id']
+    except MISSING:
+        return ''
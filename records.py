@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Converts pages of json-formatted API results into column buffers, which are
+turned into a DataFrame once at the end (used by make_df.py and
+make_df_full.py):
+
+    - Products (from Product Projections)
+    - Customers
+    - Orders (one row per line item)
+    - Categories
+
+Values are appended to plain lists (or typed arrays for float columns)
+instead of being written cell by cell into DataFrames.
+
+@author: amagrabi
+
+"""
+
+from array import array
+
+import numpy as np
+import pandas as pd
+
+import schema
+from pricing import PriceTable
+
+
+# Exceptions raised when an optional field is missing in the json data
+MISSING = (KeyError, IndexError, TypeError)
+
+
+class ColumnBuffer(object):
+    '''Column-wise buffer of records.
+
+    Args:
+        cols: Column names.
+        floats: Column names stored as typed float arrays.
+
+    '''
+
+    def __init__(self, cols, floats=()):
+        self.cols = list(cols)
+        self.floats = [col for col in self.cols if col in floats]
+        self.data = {}
+        for col in self.cols:
+            self.data[col] = array('d') if col in self.floats else []
+
+    def __len__(self):
+        return len(self.data[self.cols[0]]) if self.cols else 0
+
+    def new(self):
+        '''Empty buffer with the same columns.
+
+        '''
+        return ColumnBuffer(self.cols, self.floats)
+
+    def extend(self, other):
+        '''Appends all records of another buffer with the same columns.
+
+        '''
+        for col in self.cols:
+            self.data[col].extend(other.data[col])
+
+    def to_df(self):
+        '''Creates a DataFrame from the buffered records.
+
+        '''
+        data = {}
+        for col in self.cols:
+            if col in self.floats:
+                data[col] = np.array(self.data[col], dtype=float)
+            else:
+                data[col] = self.data[col]
+        return pd.DataFrame(data, columns=self.cols)
+
+    def to_typed(self):
+        '''Creates a schema.TypedFrame (typed columns) from the buffered records.
+
+        '''
+        return schema.typed_columns(self.data, self.cols)
+
+    def records(self):
+        '''Buffered records as list of dictionaries (column: value).
+
+        '''
+        return [dict(zip(self.cols, values))
+                for values in zip(*[self.data[col] for col in self.cols])]
+
+
+def products_buffer(languages=['en','de'], currencies=['USD','EUR'], expand=False):
+    '''Empty column buffer for products.
+
+    With expand, there are columns for the category names (categoryNames_<lang>)
+    and the path of the first category (categoryPath_<lang>, as in
+    api_util.get_category_paths with restrict=True).
+
+    '''
+    cols = ['id','sku','categoryIds','img','createdAt','version','lastModifiedAt']
+    # Language-dependent variables
+    ld_vars = ['name', 'slug', 'description']
+    if expand:
+        ld_vars += ['categoryNames', 'categoryPath']
+    cols += [ld_var + '_' + language for ld_var in ld_vars for language in languages]
+    # Currency-dependent variables
+    cd_vars = ['price']
+    floats = [cd_var + '_' + currency for cd_var in cd_vars for currency in currencies]
+    return ColumnBuffer(cols + floats, floats)
+
+
+def _category_names(cat_json, languages):
+    # Name and path of an expanded category reference per language (empty
+    # names if the category or its ancestors were not expanded)
+    obj = cat_json.get('obj', {})
+    ancestors = [anc.get('obj', {}) for anc in obj.get('ancestors', [])]
+    names = {}
+    for language in languages:
+        path = []
+        for cat in ancestors + [obj]:
+            try:
+                path.append(cat['name'][language])
+            except MISSING:
+                path.append('')
+        names[language] = (path[-1], ' > '.join(path))
+    return names
+
+
+def add_products(buf, results, languages=['en','de'], currencies=['USD','EUR'],
+                 expand=False, country='', channel='', customer_group='',
+                 date=''):
+    '''Appends a page of products (product projections) to a column buffer.
+
+    Args:
+        buf: ColumnBuffer from products_buffer().
+        results: List of products in json.
+        languages: Languages of language-dependent variables.
+        currencies: Currencies of prices.
+        expand: Flag to fill the category name and path columns from
+            expanded category references (expand=categories[*] and
+            categories[*].ancestors[*]).
+        country: Country of prices (default: any country).
+        channel: Channel id of prices (default: any channel).
+        customer_group: Customer group id of prices (default: any group).
+        date: ISO 8601 date at which prices are valid (default: any date).
+
+    Returns:
+        The column buffer.
+
+    '''
+    data = buf.data
+    ld_vars = ['name', 'slug', 'description']
+    # Names and paths of the categories of this page, so categories shared
+    # by many products are only resolved once (and share their strings)
+    categories = {}
+
+    for product in results:
+
+        # Mandatory fields
+        data['id'].append(product['id'])
+        data['createdAt'].append(product['createdAt'])
+        data['version'].append(product['version'])
+        data['lastModifiedAt'].append(product['lastModifiedAt'])
+
+        # Optional fields
+        try:
+            data['sku'].append(product['masterVariant']['sku'])
+        except MISSING:
+            data['sku'].append('')
+
+        try:
+            data['img'].append(product['masterVariant']['images'][0]['url'])
+        except MISSING:
+            data['img'].append('')
+
+        # Language-dependent variables
+        for ld_var in ld_vars:
+            for language in languages:
+                try:
+                    data[ld_var + '_' + language].append(product[ld_var][language])
+                except MISSING:
+                    data[ld_var + '_' + language].append('')
+
+        # Categories
+        data['categoryIds'].append([cat_json['id'] for cat_json in product['categories']])
+        if expand:
+            names = []
+            for cat_json in product['categories']:
+                if cat_json['id'] not in categories:
+                    categories[cat_json['id']] = _category_names(cat_json, languages)
+                names.append(categories[cat_json['id']])
+            for language in languages:
+                data['categoryNames_' + language].append([cat[language][0] for cat in names])
+                data['categoryPath_' + language].append(names[0][language][1] if names else '')
+
+    # Currency-dependent variables (prices of the page flattened once and
+    # resolved for all currencies with array operations)
+    prices = PriceTable.from_products(results)
+    for col, values in prices.columns(currencies, country, channel,
+                                      customer_group, date).items():
+        data[col].extend(values.tolist())
+
+    return buf
+
+
+def customers_buffer():
+    '''Empty column buffer for customers.
+
+    '''
+    cols = ['id', 'firstName', 'middleName', 'lastName', 'email',
+            'dateOfBirth', 'companyName',
+            'customerGroup_ids', 'customerGroup_names', 'createdAt',
+            'version', 'lastModifiedAt']
+    return ColumnBuffer(cols)
+
+
+def add_customers(buf, results):
+    '''Appends a page of customers to a column buffer.
+
+    Args:
+        buf: ColumnBuffer from customers_buffer().
+        results: List of customers in json.
+
+    Returns:
+        The column buffer.
+
+    '''
+    data = buf.data
+    optional = ['firstName', 'lastName', 'middleName', 'email', 'dateOfBirth',
+                'companyName']
+
+    for customer in results:
+
+        # Mandatory fields
+        data['id'].append(customer['id'])
+        data['createdAt'].append(customer['createdAt'])
+        data['version'].append(customer['version'])
+        data['lastModifiedAt'].append(customer['lastModifiedAt'])
+
+        # Optional fields
+        for field in optional:
+            data[field].append(customer.get(field, ''))
+
+        # Customer groups (a single reference, names only if it is expanded)
+        try:
+            groups_json = customer['customerGroup']
+            if not isinstance(groups_json, list):
+                groups_json = [groups_json]
+            groups_ids = []
+            groups_names = []
+            for group_json in groups_json:
+                try:
+                    groups_ids.append(group_json['id'])
+                except MISSING:
+                    pass
+                try:
+                    groups_names.append(group_json['obj']['name'])
+                except MISSING:
+                    pass
+        except MISSING:
+            groups_ids = ''
+            groups_names = ''
+        data['customerGroup_ids'].append(groups_ids)
+        data['customerGroup_names'].append(groups_names)
+
+    return buf
+
+
+def orders_buffer(languages=['en','de']):
+    '''Empty column buffer for orders (one row per line item).
+
+    '''
+    cols = ['productId','customerId','customerEmail','anonymousId','orderId',
+            'createdAt','productPrice','totalPrice','currency','quantity',
+            'country','version','lastModifiedAt']
+    # Language-dependent variables
+    ld_vars = ['name']
+    cols += [ld_var + '_' + language for ld_var in ld_vars for language in languages]
+    return ColumnBuffer(cols)
+
+
+def add_orders(buf, results, languages=['en','de']):
+    '''Appends a page of orders to a column buffer (one row per line item).
+
+    Args:
+        buf: ColumnBuffer from orders_buffer().
+        results: List of orders in json.
+        languages: Languages of language-dependent variables.
+
+    Returns:
+        The column buffer.
+
+    '''
+    data = buf.data
+    ld_vars = ['name']
+
+    for order in results:
+
+        # Order fields (identical for all line items)
+        order_id = order['id']
+        created_at = order['createdAt']
+        version = order['version']
+        last_modified_at = order['lastModifiedAt']
+        total_price = order['totalPrice']['centAmount']
+        customer_id = order.get('customerId', 'anonymous')
+        customer_email = order.get('customerEmail', '')
+        anonymous_id = order.get('anonymousId', '')
+        country = order.get('country', '')
+
+        for line_item in order['lineItems']:
+
+            # Mandatory fields
+            data['orderId'].append(order_id)
+            data['productId'].append(line_item['productId'])
+            data['createdAt'].append(created_at)
+            data['totalPrice'].append(total_price)
+            data['version'].append(version)
+            data['lastModifiedAt'].append(last_modified_at)
+
+            # Optional fields
+            data['customerId'].append(customer_id)
+            data['customerEmail'].append(customer_email)
+            data['anonymousId'].append(anonymous_id)
+            data['country'].append(country)
+
+            try:
+                data['productPrice'].append(line_item['price']['value']['centAmount'])
+            except MISSING:
+                data['productPrice'].append('')
+
+            try:
+                data['currency'].append(line_item['price']['value']['currencyCode'])
+            except MISSING:
+                data['currency'].append('')
+
+            try:
+                data['quantity'].append(line_item['quantity'])
+            except MISSING:
+                data['quantity'].append('')
+
+            # Language-dependent variables
+            for ld_var in ld_vars:
+                for language in languages:
+                    try:
+                        data[ld_var + '_' + language].append(line_item[ld_var][language])
+                    except MISSING:
+                        data[ld_var + '_' + language].append('')
+
+    return buf
+
+
+def categories_buffer(languages=['en','de']):
+    '''Empty column buffer for categories.
+
+    '''
+    cols = ['id','createdAt','version','lastModifiedAt','parentId','ancestorIds']
+    # Language-dependent variables
+    ld_vars = ['name','slug','description']
+    cols += [ld_var + '_' + language for ld_var in ld_vars for language in languages]
+    return ColumnBuffer(cols)
+
+
+def add_categories(buf, results, languages=['en','de']):
+    '''Appends a page of categories to a column buffer.
+
+    Args:
+        buf: ColumnBuffer from categories_buffer().
+        results: List of categories in json.
+        languages: Languages of language-dependent variables.
+
+    Returns:
+        The column buffer.
+
+    '''
+    data = buf.data
+    ld_vars = ['name','slug','description']
+
+    for category in results:
+
+        # Mandatory fields
+        data['id'].append(category['id'])
+        data['createdAt'].append(category['createdAt'])
+        data['version'].append(category['version'])
+        data['lastModifiedAt'].append(category['lastModifiedAt'])
+
+        # Category tree
+        try:
+            data['parentId'].append(category['parent']['id'])
+        except MISSING:
+            data['parentId'].append('')
+        data['ancestorIds'].append([anc_json['id'] for anc_json in category.get('ancestors', [])])
+
+        # Language-dependent variables
+        for ld_var in ld_vars:
+            for language in languages:
+                try:
+                    data[ld_var + '_' + language].append(category[ld_var][language])
+                except MISSING:
+                    data[ld_var + '_' + language].append('')
+
+    return buf
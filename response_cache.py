@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Disk-backed cache of API responses for api.query (see api.configure()).
+
+Response bodies are stored by url in a SQLite file together with their ETag
+and entity version. Entries younger than the TTL are served without a
+request; older ones are revalidated with If-None-Match if the API sent an
+ETag (a 304 response renews them). The cache is bounded in size and evicts
+the least recently used entries. In offline mode, only cached responses are
+served (regardless of their age).
+
+Usage:
+
+    api.configure(cache=ResponseCache('cache/responses.db', ttl=3600))
+
+@author: amagrabi
+
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache(object):
+    '''Size-bounded LRU cache of response bodies by url.
+
+    Args:
+        path: Path of the SQLite file.
+        ttl: Seconds during which entries are served without revalidation
+            (None: entries never expire).
+        max_bytes: Maximum total size of the cached bodies.
+        offline: Flag to only serve cached responses.
+
+    '''
+
+    def __init__(self, path, ttl=3600, max_bytes=512*2**20, offline=False):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                         'url TEXT PRIMARY KEY, body BLOB, etag TEXT, '
+                         'version INTEGER, size INTEGER, stored_at REAL, '
+                         'accessed_at REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed '
+                         'ON responses (accessed_at)')
+        self._db.commit()
+        self.size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def get(self, url):
+        '''Cached entry of a url (None if there is none).
+
+        Returns:
+            Dictionary with body (bytes), etag, version and fresh (flag whether
+            the entry is younger than the TTL).
+
+        '''
+        with self._lock:
+            row = self._db.execute('SELECT body, etag, version, stored_at FROM responses '
+                                   'WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            self._db.execute('UPDATE responses SET accessed_at = ? WHERE url = ?', (now, url))
+            self._db.commit()
+        body, etag, version, stored_at = row
+        return {'body': bytes(body), 'etag': etag, 'version': version,
+                'fresh': self.ttl is None or now - stored_at < self.ttl}
+
+    def put(self, url, body, etag=None, version=None):
+        '''Stores the body of a response (evicting least recently used entries).
+
+        '''
+        if len(body) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (url, sqlite3.Binary(body), etag, version, len(body), now, now))
+            self.size += len(body) - (row[0] if row else 0)
+            if self.size > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def renew(self, url):
+        '''Marks an entry as fresh again (after a 304 response).
+
+        '''
+        now = time.time()
+        with self._lock:
+            self._db.execute('UPDATE responses SET stored_at = ?, accessed_at = ? '
+                             'WHERE url = ?', (now, now, url))
+            self._db.commit()
+
+    def _evict(self):
+        rows = self._db.execute('SELECT url, size FROM responses ORDER BY accessed_at').fetchall()
+        evicted = []
+        for url, size in rows:
+            if self.size <= self.max_bytes:
+                break
+            evicted.append((url,))
+            self.size -= size
+        self._db.executemany('DELETE FROM responses WHERE url = ?', evicted)
+
+    def reopen(self):
+        '''Opens the cache file again (e.g. in a forked process).
+
+        '''
+        return ResponseCache(self.path, self.ttl, self.max_bytes, self.offline)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM responses')
+            self._db.commit()
+            self.size = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Shared scheduler for API requests (used by api.login and api.query):
+
+    - Token bucket to limit the request rate
+    - AIMD concurrency limit: grows by one slot per window of healthy
+      responses, halves when the API throttles (429/503)
+    - Retries with exponential backoff and full jitter, respecting the
+      Retry-After header of throttled responses
+
+@author: amagrabi
+
+"""
+
+import datetime
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+
+# Statuses of responses which are retried
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Statuses which signal throttling (shrink the concurrency limit)
+THROTTLE_STATUSES = (429, 503)
+
+# Exceptions of requests which are retried (other exceptions are raised)
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError)
+
+
+class TokenBucket(object):
+    '''Limits the rate of events.
+
+    Args:
+        rate: Tokens added per second (None for no limit).
+        burst: Maximum number of tokens (default: one second of tokens).
+
+    '''
+
+    def __init__(self, rate=None, burst=None):
+        if burst is None:
+            burst = rate if rate else 1
+        self.rate = rate
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''Blocks until a token is available and takes it.
+
+        '''
+        if self.rate is None:
+            return
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated)*self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens)/self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter(object):
+    '''Limits the number of concurrent requests (AIMD).
+
+    The limit grows by one after a full window (as many healthy responses as
+    the current limit) and is multiplied by decrease on throttling.
+
+    Args:
+        limit: Initial limit.
+        minimum: Lower bound of the limit.
+        maximum: Upper bound of the limit.
+        decrease: Factor applied to the limit on throttling.
+
+    '''
+
+    def __init__(self, limit=8, minimum=1, maximum=64, decrease=0.5):
+        self.limit = float(limit)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        '''Blocks until a slot is available and takes it.
+
+        '''
+        with self._condition:
+            while self.active >= int(self.limit):
+                self._condition.wait()
+            self.active += 1
+
+    def release(self, throttled=False, adapt=True):
+        '''Frees a slot and adapts the limit to the outcome of the request
+        (unless adapt is False, e.g. for requests which failed locally).
+
+        '''
+        with self._condition:
+            self.active -= 1
+            if not adapt:
+                pass
+            elif throttled:
+                self.limit = max(self.minimum, self.limit*self.decrease)
+            else:
+                self.limit = min(self.maximum, self.limit + 1/self.limit)
+            self._condition.notify_all()
+
+
+def retry_after(response):
+    '''Seconds to wait according to the Retry-After header (None if absent).
+
+    '''
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = datetime.datetime.now(date.tzinfo)
+    return max(0.0, (date - now).total_seconds())
+
+
+class RequestScheduler(object):
+    '''Sends requests within rate and concurrency limits and retries them.
+
+    Args:
+        rate: Maximum requests per second (None for no limit).
+        burst: Maximum burst of requests above the rate.
+        concurrency: Initial limit of concurrent requests.
+        max_concurrency: Upper bound of concurrent requests.
+        max_retries: Maximum number of retries per request.
+        backoff: Base delay of the exponential backoff in seconds.
+        max_backoff: Maximum delay between retries in seconds.
+
+    '''
+
+    def __init__(self, rate=None, burst=None, concurrency=8, max_concurrency=64,
+                 max_retries=6, backoff=0.5, max_backoff=60.0):
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveLimiter(concurrency, 1, max_concurrency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = {'retries': 0, 'throttled': 0}
+        self._lock = threading.Lock()
+
+    def delay(self, attempt, response=None):
+        '''Seconds to wait before the given retry.
+
+        '''
+        if response is not None:
+            seconds = retry_after(response)
+            if seconds is not None:
+                return min(self.max_backoff, seconds)
+        # Full jitter: random delay up to the exponential backoff
+        return random.uniform(0, min(self.max_backoff, self.backoff*2**attempt))
+
+    def send(self, request):
+        '''Sends a request (retried on throttling, server errors, connection
+        errors and truncated responses).
+
+        Args:
+            request: Function without arguments returning a requests.Response.
+
+        Returns:
+            requests.Response (the last one if all retries failed).
+
+        '''
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self.limiter.acquire()
+            response = None
+            try:
+                response = request()
+            except RETRY_EXCEPTIONS:
+                # Network errors are no throttling (the limit is kept)
+                self.limiter.release(adapt=False)
+                if attempt >= self.max_retries:
+                    raise
+            except BaseException:
+                # Free the slot, or it is lost for all later requests
+                self.limiter.release(adapt=False)
+                raise
+            else:
+                throttled = response.status_code in THROTTLE_STATUSES
+                self.limiter.release(throttled)
+                if throttled:
+                    with self._lock:
+                        self.stats['throttled'] += 1
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+            with self._lock:
+                self.stats['retries'] += 1
+            time.sleep(self.delay(attempt, response))
+            attempt += 1
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Typed schema mode of the exported DataFrames (see ColumnBuffer.to_typed()):
+
+    - Cent amounts and quantities as int64 with a boolean <col>_missing mask
+      (pandas has no nullable integer dtype)
+    - Currency and country codes, and ids which repeat across rows (e.g.
+      orderId of line items), as categoricals
+    - Dates as datetime64 (UTC)
+    - Multi-valued fields (e.g. categoryIds, customer groups) as ListColumn,
+      i.e. flat values with offsets instead of one Python list per row
+
+@author: amagrabi
+
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Columns by type (column names or prefixes ending with '_')
+INT_COLS = ['version']
+NULLABLE_INT_COLS = ['price_', 'productPrice', 'totalPrice', 'quantity']
+CATEGORY_COLS = ['currency', 'country', 'orderId', 'productId', 'customerId',
+                 'customerEmail', 'anonymousId', 'parentId']
+DATE_COLS = ['createdAt', 'lastModifiedAt', 'dateOfBirth']
+LIST_COLS = ['categoryIds', 'ancestorIds', 'customerGroup_ids',
+             'customerGroup_names', 'categoryNames_']
+
+
+def _matches(col, names):
+    return any(col == name or (name.endswith('_') and col.startswith(name))
+               for name in names)
+
+
+class ListColumn(object):
+    '''Multi-valued column as flat values and offsets.
+
+    The values of row i are values[offsets[i]:offsets[i+1]].
+
+    Args:
+        offsets: int64 array of length (number of rows + 1).
+        values: Categorical (or array) of all values.
+
+    '''
+
+    def __init__(self, offsets, values):
+        self.offsets = offsets
+        self.values = values
+
+    @classmethod
+    def from_lists(cls, lists):
+        '''Encodes a sequence of lists (other values count as empty lists).
+
+        '''
+        lists = [value if isinstance(value, list) else [] for value in lists]
+        lengths = np.fromiter((len(value) for value in lists), dtype=np.int64,
+                              count=len(lists))
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        values = [value for row in lists for value in row]
+        return cls(offsets, pd.Categorical(values))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return list(self.values[self.offsets[i]:self.offsets[i+1]])
+
+    def lengths(self):
+        '''Number of values per row.
+
+        '''
+        return np.diff(self.offsets)
+
+    def rows(self):
+        '''Row of each value (e.g. to join values with other columns).
+
+        '''
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.lengths())
+
+    def to_lists(self):
+        return [self[i] for i in range(len(self))]
+
+
+class TypedFrame(object):
+    '''DataFrame of typed columns and the multi-valued columns of the same rows.
+
+    Attributes:
+        df: DataFrame.
+        lists: Dictionary of ListColumns by column name.
+
+    '''
+
+    def __init__(self, df, lists):
+        self.df = df
+        self.lists = lists
+
+    def __len__(self):
+        return len(self.df)
+
+    def memory_usage(self):
+        '''Bytes of all columns (including values of object columns).
+
+        '''
+        nbytes = int(self.df.memory_usage(index=False, deep=True).sum())
+        for column in self.lists.values():
+            nbytes += column.offsets.nbytes + int(pd.Series(column.values).memory_usage(index=False, deep=True))
+        return nbytes
+
+    def to_df(self):
+        '''Converts back into a DataFrame with Python lists.
+
+        '''
+        df = self.df.copy()
+        for col, column in self.lists.items():
+            df[col] = column.to_lists()
+        return df
+
+
+def typed_columns(data, cols):
+    '''Converts columns (lists of values) into the typed schema.
+
+    Args:
+        data: Dictionary of columns (lists or arrays of values).
+        cols: Column names in order.
+
+    Returns:
+        TypedFrame.
+
+    '''
+    columns = {}
+    order = []
+    lists = {}
+    for col in cols:
+        values = data[col]
+        if _matches(col, LIST_COLS):
+            lists[col] = ListColumn.from_lists(values)
+            continue
+        order.append(col)
+        if _matches(col, INT_COLS):
+            columns[col] = np.array(values, dtype=np.int64)
+        elif _matches(col, NULLABLE_INT_COLS):
+            # Missing values are NaN (float columns) or empty strings
+            numbers = pd.to_numeric(pd.Series(values, dtype=object).replace('', np.nan))
+            missing = numbers.isnull().values
+            columns[col] = numbers.fillna(0).values.astype(np.int64)
+            columns[col + '_missing'] = missing
+            order.append(col + '_missing')
+        elif _matches(col, CATEGORY_COLS):
+            columns[col] = pd.Categorical([value if value != '' else None for value in values])
+        elif _matches(col, DATE_COLS):
+            dates = pd.to_datetime([value if value != '' else None for value in values], utc=True)
+            columns[col] = dates.tz_convert(None)
+        else:
+            columns[col] = values
+    return TypedFrame(pd.DataFrame(columns, columns=order), lists)
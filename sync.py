@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+
+Incremental sync of products, customers, orders and categories into local
+snapshots (one pickled DataFrame per entity type).
+
+Every run only fetches items modified since the last seen lastModifiedAt
+(watermark, with a safety lag) and merges them into the snapshot by id and
+version. Deleted items are removed by a periodic reconciliation against the
+ids which are still available via the API. The first run (or a missing
+snapshot) makes a full export.
+
+@author: amagrabi
+
+"""
+
+import datetime
+import json
+import os
+import time
+
+import pandas as pd
+
+import config
+import make_df_full
+
+
+DIR_SNAPSHOT = os.path.join(os.getcwd(), 'snapshot', config.PROJECT_KEY)
+
+# Days between reconciliations of deleted items
+RECONCILE_DAYS = 7
+
+# Seconds subtracted from the watermark (for items modified during a fetch
+# and clock differences between the API and this machine)
+WATERMARK_LAG = 300
+
+
+def _paths(name, snapshot_dir):
+    snapshot_dir = DIR_SNAPSHOT if snapshot_dir is None else snapshot_dir
+    return (os.path.join(snapshot_dir, name + '.pkl'),
+            os.path.join(snapshot_dir, name + '.json'))
+
+
+def load_state(name, snapshot_dir=None):
+    '''Loads the sync state of an entity type.
+
+    Args:
+        name: Entity type (products, customers, orders, categories).
+        snapshot_dir: Directory of the snapshots (default: DIR_SNAPSHOT).
+
+    Returns:
+        Dictionary with the watermark and the time of the last reconciliation
+        (empty if there is no snapshot yet).
+
+    '''
+    file_snapshot, file_state = _paths(name, snapshot_dir)
+    if not os.path.exists(file_snapshot) or not os.path.exists(file_state):
+        return {}
+    with open(file_state, 'r') as f:
+        return json.load(f)
+
+
+def load_snapshot(name, snapshot_dir=None):
+    '''Loads the snapshot of an entity type (None if there is no snapshot yet).
+
+    '''
+    file_snapshot, file_state = _paths(name, snapshot_dir)
+    if not os.path.exists(file_snapshot):
+        return None
+    return pd.read_pickle(file_snapshot)
+
+
+def _save(name, snapshot_dir, df, state):
+    # Write both files via temporary files, so an interrupted run keeps the
+    # previous snapshot
+    file_snapshot, file_state = _paths(name, snapshot_dir)
+    os.makedirs(os.path.dirname(file_snapshot), exist_ok=True)
+    df.to_pickle(file_snapshot + '.tmp')
+    with open(file_state + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(file_snapshot + '.tmp', file_snapshot)
+    os.replace(file_state + '.tmp', file_state)
+
+
+def merge(df_snapshot, df_delta, key='id'):
+    '''Merges modified items into a snapshot.
+
+    Items are identified by key; for each key the rows with the highest
+    version are kept (on equal versions the modified items win). The result
+    is sorted by key, like a full export.
+
+    Args:
+        df_snapshot: DataFrame of the snapshot.
+        df_delta: DataFrame of modified items.
+        key: Column identifying an item (several rows may share a key).
+
+    Returns:
+        Merged DataFrame.
+
+    '''
+    if len(df_delta) == 0:
+        return df_snapshot
+    versions_delta = df_delta.groupby(key)['version'].max()
+    versions_snapshot = df_snapshot.groupby(key)['version'].max()
+
+    newer = df_snapshot[key].map(versions_delta)
+    keep_snapshot = newer.isnull() | (newer < df_snapshot['version'])
+    older = df_delta[key].map(versions_snapshot)
+    keep_delta = older.isnull() | (older <= df_delta['version'])
+
+    df = pd.concat([df_snapshot[keep_snapshot], df_delta[keep_delta]],
+                   ignore_index=True)
+    df = df.sort_values(key, kind='mergesort')
+    return df.reset_index(drop=True)
+
+
+def live_ids(resource, params='', size_chunks=500, verbose=True):
+    '''Ids of all items of a resource which are currently available.
+
+    The API has no field selection, so this pages through all items, but
+    only their ids are kept.
+
+    Args:
+        resource: API endpoint (product-projections, orders, etc.).
+        params: Additional query parameters (e.g. '&staged=false').
+        size_chunks: Number of items per request.
+        verbose: Flag to print progress in the terminal.
+
+    Returns:
+        Set of ids.
+
+    '''
+    ids = set()
+    for results in make_df_full._pages(resource, size_chunks, params,
+                                       resource + ' ids', verbose):
+        ids.update(item['id'] for item in results)
+    return ids
+
+
+def _sync(name, resource, fetch, key='id', params='', snapshot_dir=None,
+          reconcile_days=RECONCILE_DAYS, verbose=True):
+    '''Updates the snapshot of an entity type and returns it.
+
+    Args:
+        name: Entity type (products, customers, orders, categories).
+        resource: API endpoint of the entity type.
+        fetch: Function which fetches a DataFrame, fetch(where).
+        key: Column of the item ids.
+        params: Additional query parameters of the endpoint.
+        snapshot_dir: Directory of the snapshots (default: DIR_SNAPSHOT).
+        reconcile_days: Days between reconciliations of deleted items.
+        verbose: Flag to print progress in the terminal.
+
+    Returns:
+        DataFrame of all items.
+
+    '''
+    state = load_state(name, snapshot_dir)
+    df = load_snapshot(name, snapshot_dir) if state else None
+    now = time.time()
+
+    if df is None:
+        if verbose:
+            print('No snapshot of {}, loading all items'.format(name))
+        df = fetch(None)
+        state = {'reconciledAt': now}
+    else:
+        # Items modified at the watermark itself may have been missed by the
+        # last run, so include them (the merge drops duplicates)
+        where = None
+        if state.get('watermark'):
+            where = 'lastModifiedAt >= "{}"'.format(state['watermark'])
+        df_delta = fetch(where)
+        if verbose:
+            print('Merging {} modified rows into snapshot of {}'.format(len(df_delta), name))
+        df = merge(df, df_delta, key)
+
+        if now - state.get('reconciledAt', 0) >= reconcile_days*24*3600:
+            ids = live_ids(resource, params, verbose=verbose)
+            deleted = ~df[key].isin(ids)
+            if verbose:
+                print('Removing {} deleted rows from snapshot of {}'.format(deleted.sum(), name))
+            df = df[~deleted].reset_index(drop=True)
+            state['reconciledAt'] = now
+
+    if len(df) > 0:
+        state['watermark'] = watermark(df['lastModifiedAt'].max(), now)
+    _save(name, snapshot_dir, df, state)
+    return df
+
+
+def watermark(last_modified, start, lag=WATERMARK_LAG):
+    '''lastModifiedAt from which the next run fetches items.
+    
+    Items modified while a fetch is running can get a lastModifiedAt below 
+    that of items returned later (e.g. in pages or shards which were already 
+    fetched), so the watermark is the latest lastModifiedAt of the fetched 
+    items, but at most the start of the fetch, minus lag. Items fetched again 
+    due to the overlap are dropped by merge().
+    
+    Args:
+        last_modified: Latest lastModifiedAt of the fetched items.
+        start: Start of the fetch (seconds since the epoch).
+        lag: Seconds subtracted from the watermark.
+        
+    Returns:
+        Watermark in the date format of the API.
+        
+    '''
+    date = datetime.datetime.strptime(last_modified[:19], '%Y-%m-%dT%H:%M:%S')
+    date = min(date, datetime.datetime.utcfromtimestamp(start))
+    date -= datetime.timedelta(seconds=lag)
+    return date.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def products(staged='false', size_chunks=250, languages=['en','de'],
+             currencies=['USD','EUR'], verbose=True, shards=1,
+             max_workers=None, snapshot_dir=None,
+             reconcile_days=RECONCILE_DAYS, country='', channel='',
+             customer_group='', date=''):
+    '''Incrementally syncs the snapshot of products (see make_df_full.products).
+
+    Args:
+        snapshot_dir: Directory of the snapshots (default: DIR_SNAPSHOT).
+        reconcile_days: Days between reconciliations of deleted items.
+
+    Returns:
+        DataFrame of products.
+
+    '''
+    fetch = lambda where: make_df_full.products(staged, size_chunks, languages,
+                                                currencies, verbose, shards,
+                                                max_workers, where,
+                                                country=country, channel=channel,
+                                                customer_group=customer_group,
+                                                date=date)
+    return _sync('products_staged' if staged == 'true' else 'products',
+                 'product-projections', fetch, 'id', '&staged=' + staged,
+                 snapshot_dir, reconcile_days, verbose)
+
+
+def customers(size_chunks=250, verbose=True, shards=1, max_workers=None,
+              snapshot_dir=None, reconcile_days=RECONCILE_DAYS):
+    '''Incrementally syncs the snapshot of customers (see make_df_full.customers).
+
+    Args:
+        snapshot_dir: Directory of the snapshots (default: DIR_SNAPSHOT).
+        reconcile_days: Days between reconciliations of deleted items.
+
+    Returns:
+        DataFrame of customers.
+
+    '''
+    fetch = lambda where: make_df_full.customers(size_chunks, verbose, shards,
+                                                 max_workers, where)
+    return _sync('customers', 'customers', fetch, 'id', '', snapshot_dir,
+                 reconcile_days, verbose)
+
+
+def orders(size_chunks=250, languages=['en','de'], verbose=True, shards=1,
+           max_workers=None, snapshot_dir=None, reconcile_days=RECONCILE_DAYS):
+    '''Incrementally syncs the snapshot of orders (see make_df_full.orders).
+
+    Args:
+        snapshot_dir: Directory of the snapshots (default: DIR_SNAPSHOT).
+        reconcile_days: Days between reconciliations of deleted items.
+
+    Returns:
+        DataFrame of orders (one row per line item).
+
+    '''
+    fetch = lambda where: make_df_full.orders(size_chunks, languages, verbose,
+                                              shards, max_workers, where)
+    return _sync('orders', 'orders', fetch, 'orderId', '', snapshot_dir,
+                 reconcile_days, verbose)
+
+
+def categories(size_chunks=250, languages=['en','de'], verbose=True, shards=1,
+               max_workers=None, snapshot_dir=None,
+               reconcile_days=RECONCILE_DAYS):
+    '''Incrementally syncs the snapshot of categories (see make_df_full.categories).
+
+    Args:
+        snapshot_dir: Directory of the snapshots (default: DIR_SNAPSHOT).
+        reconcile_days: Days between reconciliations of deleted items.
+
+    Returns:
+        DataFrame of categories.
+
+    '''
+    fetch = lambda where: make_df_full.categories(size_chunks, languages, verbose,
+                                                  shards, max_workers, where)
+    return _sync('categories', 'categories', fetch, 'id', '', snapshot_dir,
+                 reconcile_days, verbose)
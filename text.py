@@ -8,8 +8,19 @@ Helper functions to process text.
 
 """
 
+import gzip
+import os
 import re
 import dateutil.parser
+import numpy as np
+import pandas as pd
+
+
+# Number of characters read at a time by change_textfile
+BUFFER_SIZE = 2**20
+
+# Layout of commercetools timestamps (d: digit), e.g. 2017-06-01T12:34:56.789Z
+ISO_LAYOUT = 'dddd-dd-ddTdd:dd:dd.dddZ'
 
 
 def date_to_us(date_str):
@@ -24,33 +35,177 @@ def date_to_us(date_str):
     date = dateutil.parser.parse(date_str)
     dateformat = '%d-%m-%y %I:%M:%S.%f %p'
     return date.strftime(dateformat)
+
+
+def dates_to_us(dates):
+    '''Convert dates to Beveel format (vectorized date_to_us).
+    
+    Dates in the layout of commercetools timestamps (ISO_LAYOUT) are converted 
+    with array operations, by rearranging their characters into the Beveel 
+    format. All other dates are converted with date_to_us.
+    
+    Args:
+        dates: Sequence of input dates (e.g. Series).
+        
+    Returns:
+        Converted dates (Series with the same index if dates is a Series, 
+        otherwise list).
+    '''
+    values = list(dates)
+    n = len(values)
+    width = len(ISO_LAYOUT)
+    
+    # Characters as code points (with one more column than the layout, 
+    # which is only zero for strings of the same length)
+    chars = np.array(values, dtype='U{}'.format(width + 1)).view(np.uint32)
+    chars = chars.reshape(n, width + 1).astype(np.int64)
+    digits = [i for i, c in enumerate(ISO_LAYOUT) if c == 'd']
+    seps = [i for i, c in enumerate(ISO_LAYOUT) if c != 'd']
+    numbers = chars[:, digits] - ord('0')
+    fast = (chars[:, width] == 0) & (chars[:, width-1] != 0)
+    fast &= (chars[:, seps] == [ord(ISO_LAYOUT[i]) for i in seps]).all(axis=1)
+    fast &= ((numbers >= 0) & (numbers <= 9)).all(axis=1)
+    
+    # Only valid dates (others are left to date_to_us, which raises errors)
+    year, month, day = _number(chars, 0, 4), _number(chars, 5, 7), _number(chars, 8, 10)
+    hour, minute, second = _number(chars, 11, 13), _number(chars, 14, 16), _number(chars, 17, 19)
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_days = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+    fast &= (month >= 1) & (month <= 12) & (year >= 1)
+    fast &= (day >= 1) & (day <= month_days[np.clip(month, 0, 12)] + (leap & (month == 2)))
+    fast &= (hour < 24) & (minute < 60) & (second < 60)
+    
+    # '%d-%m-%y %I:%M:%S.%f %p' (microseconds from milliseconds)
+    out = np.zeros((n, 27), dtype=np.uint32)
+    out[:] = [ord(c) for c in '00-00-00 00:00:00.000000 AM']
+    out[:, 0:2] = chars[:, 8:10]
+    out[:, 3:5] = chars[:, 5:7]
+    out[:, 6:8] = chars[:, 2:4]
+    hour12 = np.where(hour % 12 == 0, 12, hour % 12)
+    out[:, 9] = ord('0') + hour12 // 10
+    out[:, 10] = ord('0') + hour12 % 10
+    out[:, 12:14] = chars[:, 14:16]
+    out[:, 15:17] = chars[:, 17:19]
+    out[:, 18:21] = chars[:, 20:23]
+    out[hour >= 12, 25] = ord('P')
+    converted = out.view('U27').ravel().tolist()
+    
+    for i in np.flatnonzero(~fast):
+        converted[i] = date_to_us(values[i])
+    
+    if isinstance(dates, pd.Series):
+        return pd.Series(converted, index=dates.index, name=dates.name)
+    return converted
+
+
+def _number(chars, start, end):
+    # Numbers from the digits at positions start to end (exclusive)
+    return (chars[:, start:end] - ord('0')).dot(10**np.arange(end - start - 1, -1, -1))
         
 
-def change_textfile(textfile, changefile):
+def change_textfile(textfile, changefile, output=None, buffer_size=BUFFER_SIZE):
     '''Converts strings in given textfile based on a dictionary (defined via a separate textfile).
     
+    The textfile is streamed in buffers of fixed size (so memory is bounded 
+    for files of any size), and written to a temporary file which replaces 
+    the output file when complete. Files ending with '.gz' are read and 
+    written with gzip compression.
+    
     Args:
         textfile: Input textfile.
         changefile: Textfile of a dictionary indicating string transformations.
+        output: Output textfile (default: textfile, i.e. it is changed in place).
+        buffer_size: Number of characters read at a time.
         
     '''
     changelist = {}
     with open(changefile, 'r') as f:
-        lines = f.read().splitlines()
-        for line in lines:
-           (key, val) = line.split(': ')
-           changelist[key] = val
-        f.close()
+        for line in f.read().splitlines():
+            (key, val) = line.split(': ')
+            changelist[key] = val
+
+    output = textfile if output is None else output
+    pattern = re.compile(r'\b' + trie_regex(changelist.keys()) + r'\b')
+    max_length = max([len(key) for key in changelist] + [0])
+    
+    with _open_text(textfile, 'r', textfile.endswith('.gz')) as source, \
+         _open_text(output + '.tmp', 'w', output.endswith('.gz')) as target:
+        try:
+            _change_stream(source, target, pattern, changelist, max_length, buffer_size)
+        except BaseException:
+            target.close()
+            os.remove(output + '.tmp')
+            raise
+    os.replace(output + '.tmp', output)
 
-    pattern = re.compile(r'\b(' + '|'.join(changelist.keys()) + r')\b')
 
-    with open(textfile, 'r') as f:
-        lines = f.readlines()
-        f.close()
+def trie_regex(words):
+    '''Regular expression matching any of the words, compiled from a trie.
+    
+    Words with common prefixes share their prefix in the expression (e.g. 
+    'g_(?:id|title)'), so the regex engine only follows branches which match 
+    the text instead of trying each word in turn. Longer words are preferred.
+    
+    Args:
+        words: Iterable of strings.
         
-    with open(textfile, 'w') as f:
-        for i, line in enumerate(lines):
-            lines[i] = pattern.sub(lambda x: changelist[x.group()], line)
-        f.writelines(lines)
-        f.close()
-        
\ No newline at end of file
+    Returns:
+        Regular expression (string, a non-capturing group).
+    '''
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    if len(trie) == 0:
+        return '(?!)'
+    return '(?:' + _trie_regex(trie) + ')'
+
+
+def _trie_regex(node):
+    branches = [re.escape(char) + _trie_regex(child)
+                for char, child in sorted(node.items()) if char != '']
+    if len(branches) == 0:
+        return ''
+    regex = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if '' in node:
+        # A word ends here (greedy, so longer words are tried first)
+        regex = '(?:' + regex + ')?'
+    return regex
+
+
+def _open_text(path, mode, compress):
+    if compress:
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def _change_stream(source, target, pattern, changelist, max_length, buffer_size):
+    # Text is substituted up to a limit which leaves max_length characters 
+    # (plus one for the word boundary) of the buffer, so matches found 
+    # before the limit are complete, and the rest is carried over to the next 
+    # buffer. The character before the carry is kept as context, so word 
+    # boundaries at the start of the carry are the same as in the whole text.
+    context = ''
+    carry = ''
+    while True:
+        chunk = source.read(buffer_size)
+        text = context + carry + chunk
+        start = len(context)
+        limit = len(text) - max_length - 1 if chunk else len(text)
+        parts = []
+        pos = start
+        for match in pattern.finditer(text, start):
+            if match.start() >= limit:
+                break
+            parts.append(text[pos:match.start()])
+            parts.append(changelist[match.group()])
+            pos = match.end()
+        end = max(pos, limit)
+        parts.append(text[pos:end])
+        target.write(''.join(parts))
+        if not chunk:
+            return
+        context = text[end-1:end]
+        carry = text[end:]